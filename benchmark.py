@@ -0,0 +1,321 @@
+# Benchmark suite for the Linux Log Parser
+
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import yaml
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+import linux_main
+
+
+HOSTNAMES = ["web01", "db02", "bastion", "worker-7"]
+PROGRAMS = ["sshd", "CRON", "systemd", "kernel", "sudo", "dbus-daemon", "NetworkManager"]
+MESSAGES = [
+    "Accepted publickey for root from 10.0.{a}.{b} port {port} ssh2: RSA SHA256:{token}",
+    "Failed password for invalid user admin from 192.168.{a}.{b} port {port} ssh2",
+    "pam_unix(sshd:session): session opened for user deploy by (uid=0)",
+    "(root) CMD (/usr/lib64/sa/sa1 1 1)",
+    "Started Session {port} of user root.",
+    "IPv4: martian source 10.0.{a}.{b} from 10.0.{b}.{a}, on dev eth0",
+    "deploy : TTY=pts/0 ; PWD=/home/deploy ; USER=root ; COMMAND=/bin/systemctl restart nginx",
+]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmarks log discovery, decompression, counting and shipping on synthetic triage outputs")
+    parser.add_argument('-s', '--system', action='store', choices=['rhel7', 'ubuntu', 'all'], default='all', help="Specify the type of OS of the synthetic triage outputs")
+    parser.add_argument('--size-mb', action='store', type=float, default=50, help="Specify the approximate size of each synthetic triage output in MB")
+    parser.add_argument('--rotations', action='store', type=int, default=4, help="Specify the number of rotations generated for each log")
+    parser.add_argument('--malformed', action='store', type=float, default=0.01, help="Specify the ratio of malformed lines in each log")
+    parser.add_argument('--seed', action='store', type=int, default=1, help="Specify the seed used to generate the logs")
+    parser.add_argument('-w', '--workers', action='store', type=int, default=os.cpu_count() or 1, help="Specify the number of workers used to decompress and count log files")
+    parser.add_argument('--batch-size', action='store', type=int, default=1000, help="Specify the number of logs sent per bulk request")
+    parser.add_argument('--max-inflight', action='store', type=int, default=4, help="Specify the number of bulk requests sent in parallel")
+    parser.add_argument('--keep', action='store', metavar='DIR', default=None, help="Specify a directory to generate the triage outputs in and keep them afterwards")
+    parser.add_argument('--json', action='store', metavar='FILE', default=None, help="Specify a file to save the results to as JSON")
+
+    return parser.parse_args()
+
+
+def syslog_line(rng):
+    message = rng.choice(MESSAGES).format(a=rng.randint(0, 255), b=rng.randint(0, 255), port=rng.randint(1024, 65535),
+                                          token="%032x" % rng.getrandbits(128))
+    return (f"{rng.choice(MONTHS)} {rng.randint(1, 28):2d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d} "
+            f"{rng.choice(HOSTNAMES)} {rng.choice(PROGRAMS)}[{rng.randint(1, 65535)}]: {message}\n").encode()
+
+
+def audit_event(rng, serial):
+    # One execve event as auditd writes it: a record per type sharing the msg=audit(time:serial) of the event
+    timestamp = f"{rng.randint(1600000000, 1700000000)}.{rng.randint(0, 999):03d}"
+    header = f"msg=audit({timestamp}:{serial}):"
+    proctitle = os.urandom(12).hex().upper()
+    return (f"type=SYSCALL {header} arch=c000003e syscall=59 success=yes exit=0 a0=55d0c2a0 a1=55d0c2b8 "
+            f"pid={rng.randint(1, 65535)} uid=0 auid=1000 comm=\"bash\" exe=\"/usr/bin/bash\" key=(null)\n"
+            f"type=EXECVE {header} argc=2 a0=\"ls\" a1=2D6C61202F746D70\n"
+            f"type=CWD {header} cwd=\"/root\"\n"
+            f"type=PATH {header} item=0 name=\"/usr/bin/ls\" inode={rng.randint(1, 999999)} nametype=NORMAL\n"
+            f"type=PROCTITLE {header} proctitle={proctitle}\n").encode()
+
+
+def malformed_line(rng):
+    # Truncated records, invalid UTF-8 and very long lines all show up in real triage outputs
+    return rng.choice([
+        b"Oct  3 12:",
+        b"\xff\xfe\x00garbage \xc3\x28 bytes\n",
+        b"x" * rng.randint(4096, 16384) + b"\n",
+        b"\n",
+    ])
+
+
+def write_log(path, size, malformed, rng, audit=False, compress=False):
+    # Writes roughly size bytes of log lines and returns the number of bytes written before compression
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    serial = rng.randint(1, 100000)
+    opener = gzip.open if compress else open
+    with opener(path, 'wb') as f:
+        while written < size:
+            if rng.random() < malformed:
+                line = malformed_line(rng)
+
+            elif audit:
+                serial += 1
+                line = audit_event(rng, serial)
+
+            else:
+                line = syslog_line(rng)
+
+            f.write(line)
+            written += len(line)
+
+    return written
+
+
+def generate_triage(out_dir, system, size_mb, rotations, malformed, seed):
+    """
+    Builds a synthetic triage output shaped like the paths in config/<system>.yml. Each log gets a current file and a
+    number of rotations named the way the distribution names them (dateext for rhel7, numbered for ubuntu), with all
+    but the most recent rotation gzipped.
+    """
+    rng = random.Random(seed)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", f"{system}.yml"), "r") as yml_file:
+        config_file = yaml.safe_load(yml_file)
+
+    sub_paths = []
+    for module in config_file.keys():
+        for filetype in config_file[module].keys():
+            sub_paths.extend(config_file[module][filetype])
+
+    triage_dir = os.path.join(out_dir, f"{system}-triage_20211006_143423")
+    per_file = int(size_mb * 1024 * 1024 / (len(sub_paths) * (rotations + 1)))
+    total = 0
+    for sub_path in sub_paths:
+        name = os.path.basename(sub_path)
+        audit = name == "audit"
+        if audit:
+            base = os.path.join(triage_dir, sub_path, "audit.log")
+
+        elif system == "ubuntu" and name == "auth":
+            base = os.path.join(triage_dir, sub_path + ".log")
+
+        else:
+            base = os.path.join(triage_dir, sub_path)
+
+        total += write_log(base, per_file, malformed, rng, audit=audit)
+        for i in range(1, rotations + 1):
+            if audit or system == "ubuntu":
+                rotated = f"{base}.{i}"
+
+            else:
+                rotated = f"{base}-202109{i:02d}"
+
+            compress = i > 1
+            total += write_log(rotated + (".gz" if compress else ""), per_file, malformed, rng, audit=audit, compress=compress)
+
+    return triage_dir, config_file, total
+
+
+class MockElasticsearch:
+    """
+    Minimal stand-in for an Elasticsearch node that acknowledges every bulk request without storing the documents,
+    so shipping is measured without the cost of a real cluster.
+    """
+
+    def __init__(self):
+        self.doc_count = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, code, obj):
+                data = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(data)
+
+            def route(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = self.path.split("?")[0].strip("/")
+                if not path:
+                    return self.reply(200, {"version": {"number": "7.17.0", "build_flavor": "default"}, "tagline": "You Know, for Search"})
+
+                if path.endswith("_bulk"):
+                    docs = body.count(b"\n") // 2
+                    with mock.lock:
+                        mock.doc_count += docs
+                    return self.reply(200, {"errors": False, "items": [{"index": {"status": 201}}] * docs})
+
+                if path.endswith("_count"):
+                    return self.reply(200, {"count": mock.doc_count})
+
+                return self.reply(200, {"acknowledged": True, "index": path.split("/")[0]})
+
+            def do_HEAD(self):
+                self.reply(200, {})
+
+            do_GET = do_POST = do_PUT = route
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def timed(results, stage, func, lines=0, size=0):
+    # Runs a stage with its output silenced and records its duration and throughput
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = perf_counter()
+        value = func()
+        elapsed = perf_counter() - start_time
+
+    results[stage] = {
+        "seconds": round(elapsed, 4),
+        "lines_per_s": round(lines / elapsed) if lines and elapsed else None,
+        "mb_per_s": round(size / 1024 / 1024 / elapsed, 2) if size and elapsed else None,
+    }
+    return value
+
+
+def run_benchmark(args, system, work_dir):
+    triage_dir, config_file, total_size = generate_triage(work_dir, system, args.size_mb, args.rotations, args.malformed, args.seed)
+    profile = linux_main.compile_profile(system, "", config_file)
+    results = {}
+
+    def discover():
+        index = linux_main.index_triage(triage_dir, profile.roots)
+        all_files = []
+        for log_type in profile.log_types:
+            all_files.extend(linux_main.grab_logs(triage_dir, log_type, index))
+        return index, all_files
+
+    index, all_files = timed(results, "discovery", discover)
+    gz_files = [file for file in all_files if file.endswith(".gz")]
+    gz_size = sum(os.path.getsize(file) for file in gz_files)
+
+    spool_dir = os.path.join(work_dir, "spool", system)
+    spooled = timed(results, "decompression", lambda: linux_main.spool_rotations(all_files, spool_dir, args.workers),
+                    size=gz_size)
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    gz_lines = sum(count for ship_file, count in spooled.values())
+    results["decompression"]["lines_per_s"] = round(gz_lines / results["decompression"]["seconds"]) if gz_lines else None
+
+    # Count without the line count cache so every run measures the counting itself, even in a reused work folder
+    linux_main.LINE_COUNT_CACHE = os.path.join(work_dir, "cache", f"{system}-line_counts.json")
+    if os.path.exists(linux_main.LINE_COUNT_CACHE):
+        os.remove(linux_main.LINE_COUNT_CACHE)
+    counts = timed(results, "counting", lambda: linux_main.count_all_lines(all_files, args.workers, index=index))
+    total_lines = sum(counts.values())
+    results["counting"]["lines_per_s"] = round(total_lines / results["counting"]["seconds"])
+    results["counting"]["mb_per_s"] = round(total_size / 1024 / 1024 / results["counting"]["seconds"], 2)
+
+    with MockElasticsearch() as mock:
+        # Not silenced, so a client that cannot connect says why before the benchmark exits
+        es = linux_main.connect_es(mock.url)
+
+        def ship():
+            log_sets = linux_main.collect_logs(triage_dir, profile, index)
+            actions = linux_main.generate_actions(triage_dir, log_sets)
+            return linux_main.bulk_ingest(es, "benchmark", actions, args.batch_size, args.max_inflight)
+
+        stats = timed(results, "shipping", ship)
+
+    results["shipping"]["lines_per_s"] = round(stats["indexed"] / results["shipping"]["seconds"])
+    results["shipping"]["mb_per_s"] = round(total_size / 1024 / 1024 / results["shipping"]["seconds"], 2)
+
+    return {
+        "system": system,
+        "files": len(all_files),
+        "compressed_files": len(gz_files),
+        "bytes": total_size,
+        "lines": total_lines,
+        "stages": results,
+    }
+
+
+def print_report(report):
+    print(f"{report['system']}: {report['files']} files ({report['compressed_files']} compressed), "
+          f"{report['bytes'] / 1024 / 1024:0.1f} MB, {report['lines']} lines")
+    for stage, result in report["stages"].items():
+        line = f"  {stage:<14} {linux_main.format_time(result['seconds']):>12}"
+        if result["lines_per_s"]:
+            line += f"  {result['lines_per_s']:>12,} lines/s"
+        if result["mb_per_s"]:
+            line += f"  {result['mb_per_s']:>10,.2f} MB/s"
+        print(line)
+
+
+def main():
+    args = parse_args()
+    systems = ["rhel7", "ubuntu"] if args.system == "all" else [args.system]
+
+    work_dir = args.keep or tempfile.mkdtemp(prefix="linux-log-parser-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        reports = []
+        for system in systems:
+            print(f"Generating {args.size_mb} MB {system} triage output in {work_dir}...")
+            report = run_benchmark(args, system, work_dir)
+            print_report(report)
+            reports.append(report)
+
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"Results saved to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,171 @@
 # Linux Log Parser Script for Linux
 
 import argparse
+import asyncio
 import os
 import sys
 import yaml
 import gzip
+import tarfile
+import zipfile
+import mmap
+import fnmatch
+import hashlib
+import math
+import pickle
+import calendar
+import datetime
+import time
+import functools
 import shutil
+import re
+import json
+import random
 import pprint
+import threading
+import contextlib
+import cProfile
+import pstats
+import tracemalloc
 import subprocess
-import requests
-from elasticsearch import Elasticsearch
-from time import sleep, perf_counter
+import uuid
+import ctypes
+import ctypes.util
+import select
+import struct
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from elasticsearch import Elasticsearch, __versionstr__ as es_client_version
+from time import perf_counter
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # Only needed for --export-format parquet
+
+
+CHUNK_SIZE = 1024 * 1024  # Read size used when streaming log files
+COUNT_BLOCK_SIZE = 16 * 1024 * 1024  # Block size used when counting newlines in mapped files
+LINE_COUNT_CACHE = os.path.join(".", "cache", "line_counts.json")  # Line counts keyed by path, size and mtime
+LINE_COUNT_LOCK = threading.Lock()
+PROFILE_CACHE_DIR = os.path.join(".", "cache", "profiles")  # Compiled OS profiles keyed by configuration hash
+PROFILE_VERSION = 2  # Bumped whenever OSProfile changes, so profiles cached by older versions are rebuilt
+PROFILES = {}  # OS profiles compiled or loaded during this run
+PROFILES_LOCK = threading.Lock()
+OS_RELEASE_FILES = ("etc/os-release", "usr/lib/os-release", "etc/lsb-release")  # KEY=value release files
+RELEASE_FILES = ("etc/redhat-release", "etc/centos-release", "etc/oracle-release", "etc/system-release")
+# Configurations used for distributions without one of their own, whose logs are laid out like the family's
+DISTRO_FAMILIES = {"centos": "rhel", "ol": "rhel", "rocky": "rhel", "almalinux": "rhel", "scientific": "rhel",
+                   "debian": "ubuntu"}
+ARCHIVE_SEPARATOR = "::"  # Separates an archive from the member in the paths of logs read from triage archives
+ARCHIVES = {}  # Triage archives opened during this run, keyed by path
+ARCHIVES_LOCK = threading.Lock()
+LOG_PARSERS = {"system.syslog": "syslog", "system.auth": "syslog", "auditd.log": "auditd"}  # Parser used for the lines of each log type (module.filetype)
+DEFAULT_PARSER = "syslog"
+MANIFEST_DIR = os.path.join(".", "manifests")  # Upload state of each triage output, per index
+FINGERPRINT_SIZE = 1024  # Number of leading bytes hashed to detect replaced or truncated logs
+DEDUP_CAPACITY = 1000000  # Number of unique lines the first duplicate line filter is sized for
+DEDUP_ERROR_RATE = 1e-6  # Highest share of unique lines the duplicate line filter may mistake for duplicates
+DEDUP_MAX_HASHES = 8  # Bits probed per line in each duplicate line filter, which is made larger to keep its error rate
+FILEBEAT_SHUTDOWN_TIMEOUT = "300s"  # How long Filebeat waits for Elasticsearch to acknowledge its last events on exit
+DEFAULT_POOL_SIZE = 10  # Number of connections kept alive to Elasticsearch
+ES_CLIENT_MAJOR = int(es_client_version.split(".")[0])  # 7.x clients name their connection options differently
+ES_REQUEST_TIMEOUT = 60  # Seconds a request to Elasticsearch may take
+FOLLOW_POLL_INTERVAL = 1.0  # Seconds between checks of the followed folders when inotify is not available
+FOLLOW_SETTLE_TIME = 0.2  # Seconds the events of a burst of writes are gathered for before shipping them
+ES_MAX_RETRIES = 3  # Number of other nodes a request is retried on when a node fails (at least every node given)
+ES_DEAD_TIMEOUT = 60  # Seconds a failed node is skipped before being tried again, growing while it keeps failing
+SNIFF_INTERVAL = 60  # Seconds between refreshes of the node list with --sniff
+BULK_RETRIES = 8  # Number of times documents rejected by an overloaded cluster (429) are sent again
+BULK_BACKOFF = 0.5  # Seconds of the first backoff before rejected documents are retried, doubled on each retry
+BULK_BACKOFF_MAX = 30  # Longest backoff in seconds before rejected documents are retried
+ADAPTIVE_MIN_BATCH_SIZE = 50  # Smallest bulk request --adaptive shrinks to
+ADAPTIVE_MAX_BATCH_SIZE = 20000  # Largest bulk request --adaptive grows to
+ADAPTIVE_TARGET_LATENCY = 2.0  # Seconds a bulk request may take before --adaptive shrinks the batches
+PROFILE_TOP_N = 50  # Number of entries written to the readable profiling reports
+KNOWN_INDICES = set()  # Indices known to exist on Elasticsearch during this run
+BULK_LOAD_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": "0"}  # Index settings while a --bulk-load upload runs
+FORCE_MERGE_TIMEOUT = 3600  # Seconds a force merge after a --bulk-load upload may take
+# Mappings of the fields written by the syslog and auditd parsers, set on indices created by a --bulk-load upload
+INDEX_MAPPINGS = {
+    "properties": {
+        "@timestamp": {"type": "date"},
+        "message": {"type": "text"},
+        "tags": {"type": "keyword"},
+        "agent": {"properties": {"type": {"type": "keyword"}}},
+        "event": {"properties": {"module": {"type": "keyword"}, "dataset": {"type": "keyword"}}},
+        "fields": {"properties": {"ingest_run": {"type": "keyword"}, "triage": {"type": "keyword"}}},
+        "host": {"properties": {"hostname": {"type": "keyword"}}},
+        "log": {"properties": {"file": {"properties": {"path": {"type": "keyword"}}}, "offset": {"type": "long"}}},
+        "process": {"properties": {"name": {"type": "keyword"}, "pid": {"type": "long"}, "executable": {"type": "keyword"}}},
+        "system": {"properties": {"syslog": {"properties": {"timestamp": {"type": "keyword"}}}}},
+        "auditd": {"properties": {"log": {"properties": {"sequence": {"type": "long"}, "record_type": {"type": "keyword"}}}}},
+    }
+}
+METRIC_FIELDS = [
+    ("seconds", "Time spent in each stage of a triage output's upload"),
+    ("bytes", "Bytes processed by each stage of a triage output's upload"),
+    ("lines", "Lines processed by each stage of a triage output's upload"),
+    ("lines_per_second", "Lines processed per second by each stage of a triage output's upload"),
+    ("bytes_per_second", "Bytes processed per second by each stage of a triage output's upload"),
+]
+
+EXPORT_ROW_GROUP_SIZE = 100000  # Number of lines buffered per partition before a Parquet row group is written
+SEARCH_DB_TIMEOUT = 60  # Seconds a triage output waits for another one to finish writing to the local index
+SEARCH_LIMIT = 100  # Number of lines printed by --search unless --limit is given
+PROBE_SIZE = 64 * 1024  # Bytes read from the head and tail of a log to find its first and last timestamps
+MONTHS = {m.encode(): i for i, m in enumerate(calendar.month_abbr) if m}
+ISO_TIME_PATTERN = re.compile(rb"^(\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:\.\d+)?(?:Z|[+-]\d\d:?\d\d)?)")
+AUDIT_TIME_PATTERN = re.compile(rb"msg=audit\((\d+(?:\.\d+)?):")
+AUDIT_EVENT_PATTERN = re.compile(rb"msg=audit\(((\d+(?:\.\d+)?):(\d+))\)")
+AUDIT_FIELD_PATTERN = re.compile(r"([\w-]+)=(\"[^\"]*\"|'[^']*'|\S+)")  # \s also matches the \x1d before enriched fields
+AUDIT_HEX_PATTERN = re.compile(r"^(?:[0-9A-F]{2})+$")
+AUDIT_ARG_PATTERN = re.compile(r"^a\d+(?:\[\d+\])?$")
+# Fields auditd writes in hex when they hold spaces, quotes or control characters (and in quotes otherwise)
+AUDIT_ENCODED_FIELDS = frozenset(["acct", "cmd", "comm", "cwd", "data", "dir", "exe", "file", "key", "name", "new", "old",
+                                  "path", "proctitle", "vm"])
+
+# <timestamp> <hostname> <program>[<pid>]: <message>
+SYSLOG_PATTERN = re.compile(rb"^(?P<timestamp>\w{3} [ \d]\d \d\d:\d\d:\d\d) (?P<hostname>\S+) (?P<program>[^\s\[:]+)(?:\[(?P<pid>\d+)\])?: ?(?P<message>.*)$")
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Parses Linux logs to ELK")
-    parser.add_argument('-s', '--system', action='store', nargs=1, metavar='SYS', default=None, help="Specify type of OS")
-    parser.add_argument('-u', '--url', action='store', nargs=1, metavar='HOST', default=None, help="Specify the URL for Elasticsearch instance (Including port number)")
+    parser.add_argument('-s', '--system', action='store', nargs=1, metavar='SYS', default=None, help="Specify type of OS (Detected for each triage output if not specified or \"auto\")")
+    parser.add_argument('-u', '--url', action='append', metavar='HOST', default=None, help="Specify the URL for Elasticsearch instance (Including port number). Repeat it or separate URLs with commas to spread the upload over several nodes")
+    parser.add_argument('--sniff', action='store_true', default=False, help="Discover the other nodes of the cluster from the given URLs and spread the upload over them too")
     parser.add_argument('-i', '--index', action='store', nargs=1, metavar='INDEX', default=None, help="Specify the index on Elasticsearch")
     parser.add_argument('-p', '--path', action='store', nargs='?', metavar='PATH', default=False, help="Specify the path for Filebeat directory")
-    parser.add_argument('dir', action='store', nargs=argparse.REMAINDER, metavar='DIR', default=None, help="Specify directory path to extract and parse logs from")
+    parser.add_argument('--ingest', action='store', choices=['filebeat', 'native', 'async'], default='filebeat', help="Specify whether logs are shipped by Filebeat, by the built-in bulk ingest engine or by its asyncio pipeline")
+    parser.add_argument('--batch', action='store_true', default=False, help="Upload every triage output with a single Filebeat process (Filebeat ingest only)")
+    parser.add_argument('--batch-size', action='store', type=int, metavar='N', default=1000, help="Specify the number of logs sent per bulk request (The starting size with --adaptive)")
+    parser.add_argument('--max-inflight', action='store', type=int, metavar='N', default=4, help="Specify the number of bulk requests sent in parallel (The most allowed with --adaptive)")
+    parser.add_argument('--adaptive', action='store_true', default=False, help="Adjust the batch size and the bulk requests in flight to the latency and rejections of the cluster (native and async ingest only)")
+    parser.add_argument('--readers', action='store', type=int, metavar='N', default=2, help="Specify the number of log files read at the same time (async ingest only)")
+    parser.add_argument('--pool-size', action='store', type=int, metavar='N', default=None, help="Specify the number of connections kept alive to Elasticsearch (Defaults to enough for every bulk request in flight)")
+    parser.add_argument('--bulk-load', action='store_true', default=False, help="Turn off refreshes and replicas of the index while uploading, and restore them afterwards")
+    parser.add_argument('--force-merge', action='store', type=int, nargs='?', const=1, metavar='SEGMENTS', default=None, help="Force merge the index down to SEGMENTS segments (Defaults to 1) after a --bulk-load upload")
+    parser.add_argument('--reset', action='store_true', default=False, help="Discard the saved upload state and upload every log again")
+    parser.add_argument('--resume', action='store_true', default=False, help="Only send the documents that the last upload failed to index or never reached (native and async ingest only)")
+    parser.add_argument('--dedup', action='store_true', default=False, help="Drop lines already seen in other logs of the triage output")
+    parser.add_argument('--since', action='store', metavar='TIME', default=None, help="Specify the earliest time of the logs uploaded (e.g. 2021-10-03 or \"2021-10-03 14:00:00\")")
+    parser.add_argument('--until', action='store', metavar='TIME', default=None, help="Specify the latest time of the logs uploaded")
+    parser.add_argument('--export', action='store', metavar='DIR', default=None, help="Write the parsed logs to files in DIR, partitioned by host and log type, instead of uploading them to Elasticsearch")
+    parser.add_argument('--export-format', action='store', choices=['ndjson', 'parquet'], default='ndjson', help="Specify whether exported logs are written as gzipped NDJSON or as Parquet")
+    parser.add_argument('--index-db', action='store', metavar='FILE', default=None, help="Add the parsed logs to a local SQLite full-text index in FILE instead of uploading them to Elasticsearch")
+    parser.add_argument('--search', action='store', nargs='?', const='', metavar='QUERY', default=None, help="Search the local index given with --index-db for the lines matching QUERY (FTS5 syntax), within --since/--until, and exit")
+    parser.add_argument('--hostname', action='store', metavar='NAME', default=None, help="Only search the lines logged by the given host")
+    parser.add_argument('--limit', action='store', type=int, metavar='N', default=SEARCH_LIMIT, help="Specify the number of lines printed by --search")
+    parser.add_argument('--follow', action='store_true', default=False, help="Keep uploading the lines appended to the logs, and new logs such as rotations, until interrupted")
+    parser.add_argument('--poll-interval', action='store', type=float, metavar='SECONDS', default=FOLLOW_POLL_INTERVAL, help="Specify how often the logs are checked with --follow when inotify is not available")
+    parser.add_argument('--metrics', action='store', metavar='FILE', default=None, help="Specify a file to save the timings of each stage to ('-' for stdout)")
+    parser.add_argument('--metrics-format', action='store', choices=['json', 'prometheus'], default='json', help="Specify the format of the saved metrics")
+    parser.add_argument('--profile', action='store', metavar='DIR', default=None, help="Specify a directory to save cProfile and tracemalloc reports to")
+    parser.add_argument('-j', '--jobs', action='store', type=int, metavar='N', default=1, help="Specify the number of triage outputs uploaded in parallel")
+    parser.add_argument('-w', '--workers', action='store', type=int, metavar='N', default=os.cpu_count() or 1, help="Specify the number of workers used to decompress and count log files")
+    parser.add_argument('dir', action='store', nargs=argparse.REMAINDER, metavar='DIR', default=None, help="Specify directory path (or tar, tar.gz or zip archive) to extract and parse logs from")
 
     # Print help message if no arguments were passed
     if len(sys.argv) == 1:
@@ -29,15 +175,156 @@ def parse_args():
     return parser.parse_args()
 
 
-def check_system(system):
-    for c_file in os.listdir("./config"):
-        # Supports .yml extension
-        if c_file[:-4] == system and c_file[-4:] == ".yml":
-            print("Configuration file found for " + system)
-            return read_yaml(c_file)
+# A log type of a configuration file, with the matchers compiled from its paths and the parser used for its lines
+LogType = namedtuple("LogType", ["module", "filetype", "paths", "patterns", "parser"])
+
+# A configuration file compiled for a run. `modules` pairs each module with its config file in Filebeat's modules.d
+OSProfile = namedtuple("OSProfile", ["system", "digest", "log_types", "roots", "modules"])
+
+
+def check_system(system, filebeat_dir=''):
+    # Returns the compiled profile of the OS, which is only built once per run however many triage outputs use it
+    with PROFILES_LOCK:
+        if (system, filebeat_dir) not in PROFILES:
+            PROFILES[(system, filebeat_dir)] = load_profile(system, filebeat_dir)
+
+        return PROFILES[(system, filebeat_dir)]
+
+
+def read_triage_file(abs_path, rel_path):
+    # Returns the text of a file of the triage output (folder or archive), or None if it does not exist
+    try:
+        if is_archive(abs_path):
+            with get_archive(abs_path).open_rel(rel_path) as f:
+                return f.read().decode(errors="replace")
+
+        with open(os.path.join(abs_path, rel_path), "r", errors="replace") as f:
+            return f.read()
+
+    except (OSError, KeyError):
+        return None
+
+
+def read_release_file(abs_path, rel_path):
+    # Returns the KEY=value pairs of an os-release or lsb-release file
+    fields = {}
+    for line in (read_triage_file(abs_path, rel_path) or "").splitlines():
+        key, sep, value = line.strip().partition("=")
+        if sep:
+            fields[key] = value.strip("\"'")
+
+    return fields
+
+
+def release_ids(abs_path):
+    """
+    Returns the distribution IDs (the distribution first, then those it is like) and the major version recorded in
+    the release files of a triage output, e.g. (["centos", "rhel", "fedora"], "7") for CentOS 7.
+    """
+    for rel_path in OS_RELEASE_FILES:
+        fields = read_release_file(abs_path, rel_path)
+        distro = (fields.get("ID") or fields.get("DISTRIB_ID", "")).lower()
+        if distro:
+            version = fields.get("VERSION_ID") or fields.get("DISTRIB_RELEASE", "")
+            return [distro] + fields.get("ID_LIKE", "").lower().split(), version.split(".")[0], rel_path
+
+    # Older releases only have a release string, e.g. "CentOS Linux release 7.9.2009 (Core)"
+    for rel_path in RELEASE_FILES:
+        release = read_triage_file(abs_path, rel_path)
+        if release is None:
+            continue
+
+        release = release.lower()
+        version = re.search(r"\d+", release)
+        distro = "rhel" if release.startswith("red hat") else release.split(" ", 1)[0]
+        return [distro], version.group() if version else "", rel_path
+
+    debian_version = read_triage_file(abs_path, "etc/debian_version")
+    if debian_version is not None:
+        return ["debian"], debian_version.strip().split(".")[0], "etc/debian_version"
+
+    # Triage outputs are usually named after the distribution, e.g. centos7-triage_20211006_143423
+    match = re.match(r"([a-z]+)(\d*)", triage_name(abs_path).lower())
+    if match:
+        return [match.group(1)], match.group(2), "its folder name"
+
+    return [], "", None
+
+
+def detect_system(abs_path):
+    """
+    Returns the configuration matching the distribution of the triage output, or None if there is none. The
+    distribution's own release is preferred, then the distribution, then the nearest release it has a configuration
+    for (e.g. rhel7 for RHEL 8), each tried for the distribution first and then for those it is like.
+    """
+    distros, version, source = release_ids(abs_path)
+    distros = distros + [DISTRO_FAMILIES[distro] for distro in distros if distro in DISTRO_FAMILIES]
+    systems = [c_file[:-4] for c_file in os.listdir("./config") if c_file.endswith(".yml")]
+    for distro in distros:
+        releases = [system for system in systems if re.fullmatch(rf"{re.escape(distro)}\d+", system)]
+        releases.sort(key=lambda system: abs(int(system[len(distro):]) - int(version or 0)))
+        for system in [f"{distro}{version}", distro] + releases:
+            if system in systems:
+                print(f"Detected {system} for {triage_name(abs_path)} from {source}")
+                return system
+
+    return None
+
+
+def load_profile(system, filebeat_dir=''):
+    """
+    Loads the compiled profile of the OS from the cache, or compiles and caches it. Profiles are keyed by a hash of
+    the configuration file and of the module configs available to Filebeat, so editing either rebuilds the profile.
+    """
+    conf_file_path = os.path.join("./config", f"{system}.yml")
+    if not os.path.isfile(conf_file_path):
+        print(f"{system} is currently not supported or configuration file not found")
+        sys.exit(1)
+
+    print("Configuration file found for " + system)
+    with open(conf_file_path, "rb") as yml_file:
+        content = yml_file.read()
+
+    modules_d = sorted(os.listdir(os.path.join(filebeat_dir, "modules.d"))) if filebeat_dir else []
+    digest = hashlib.sha1(repr((PROFILE_VERSION, content, modules_d)).encode()).hexdigest()
+    cache_path = os.path.join(PROFILE_CACHE_DIR, f"{system}-{digest}.pickle")
+    try:
+        with open(cache_path, "rb") as f:
+            profile = pickle.load(f)
+        if isinstance(profile, OSProfile) and profile.digest == digest:
+            return profile
+
+    except (OSError, pickle.PickleError, EOFError, AttributeError, ImportError):
+        pass
+
+    profile = compile_profile(system, digest, read_yaml(f"{system}.yml"), modules_d)
+    try:
+        os.makedirs(PROFILE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(profile, f)
+        os.replace(tmp_path, cache_path)
+
+    except OSError as e:
+        print(e)
+        print(f"Unable to cache the compiled profile to {cache_path}")
+
+    return profile
+
 
-    print(f"{system} is currently not supported or configuration file not found")
-    sys.exit(1)
+def compile_profile(system, digest, config_file, modules_d=()):
+    log_types = []
+    for module in config_file.keys():
+        for filetype in config_file[module].keys():
+            paths = tuple(config_file[module][filetype])
+            patterns = tuple(compile_pattern(sub_path) for sub_path in paths)
+            log_types.append(LogType(module, filetype, paths, patterns, LOG_PARSERS.get(f"{module}.{filetype}", DEFAULT_PARSER)))
+
+    # Filebeat supports a module if modules.d holds a config for it (e.g. system.yml or system.yml.disabled)
+    modules = tuple((module, next((module_d for module_d in modules_d if module in module_d), None))
+                    for module in config_file.keys())
+
+    return OSProfile(system, digest, tuple(log_types), config_roots(config_file), modules)
 
 
 def read_yaml(c_file):
@@ -53,38 +340,647 @@ def read_yaml(c_file):
         sys.exit(1)
 
 
-def find(file_search, path):
-    filtered = []
-    result = []
-    for root, dirs, files in os.walk(path):
-        for name in files:
-            if file_search in name:
-                filtered.append(os.path.join(root, name))
-
-    # Check for zip files
-    for file in filtered:
-        if ".gz" in file:
-            new_filename = file[:-3]
-            if new_filename in result:
-                print(new_filename + " exists in results. Skipping...")
-                continue
+def index_triage(abs_path, roots=("",)):
+    """
+    Scans the triage output once and returns an index of every file under the given root folders, keyed by absolute
+    path with its path relative to the triage output, size and mtime. Discovery, counting and shipping all work from
+    this index instead of walking the triage output again.
+    """
+    if is_archive(abs_path):
+        return get_archive(abs_path).index(roots)
+
+    index = {}
+    stack = [os.path.join(abs_path, root) if root else abs_path for root in roots]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        rel_path = os.path.relpath(entry.path, abs_path).replace(os.sep, "/")
+                        index[entry.path] = (rel_path, stat.st_size, stat.st_mtime_ns)
+
+        except OSError:
+            continue
+
+    return index
+
+
+@functools.lru_cache(maxsize=None)
+def is_archive(path):
+    return os.path.isfile(path) and (tarfile.is_tarfile(path) or zipfile.is_zipfile(path))
 
-            with gzip.open(file, 'rb') as f_in:
-                with open(new_filename, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
 
-            result.append(new_filename)
+@functools.lru_cache(maxsize=None)
+def triage_name(abs_path):
+    # Name of the triage output, without the extension of an archive (e.g. centos7-triage_20211006_143423.tar.gz)
+    basename = os.path.basename(abs_path)
+    if is_archive(abs_path):
+        return re.sub(r"\.(tar(\.\w+)?|tgz|tbz2|txz|zip)$", "", basename)
+
+    return basename
+
+
+class TriageArchive:
+    """
+    A tar (plain or compressed) or zip triage output, read in place without being extracted. Its members are addressed
+    as "<archive>::<member>", and their paths relative to the triage output leave out the folder the whole archive is
+    usually packed in (e.g. centos7-triage_20211006_143423/var/log/messages is var/log/messages). A compressed tar can
+    only be read quickly front to back, so its members are read one at a time in archive order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.members = {}  # Member name -> (archive entry, size, mtime_ns, position in the archive)
+        self.heads = {}  # Member name -> first FINGERPRINT_SIZE bytes, for fingerprint()
+        if zipfile.is_zipfile(path):
+            self.archive = zipfile.ZipFile(path)
+            for info in self.archive.infolist():
+                if not info.is_dir():
+                    mtime = calendar.timegm(info.date_time + (0, 0, 0))
+                    self.members[info.filename] = (info, info.file_size, mtime * 10 ** 9, info.header_offset)
 
         else:
-            if file in result:
-                print(file + " exists in results. Skipping...")
-                continue
-            result.append(file)
+            # Listing a compressed tar decompresses all of it, so the heads of the members are kept on the way
+            self.archive = tarfile.open(path, "r:*")
+            for info in self.archive:
+                if info.isfile():
+                    self.members[info.name] = (info, info.size, int(info.mtime * 10 ** 9), info.offset_data)
+                    self.heads[info.name] = self.archive.extractfile(info).read(FINGERPRINT_SIZE)
+
+        names = [name[2:] if name.startswith("./") else name for name in self.members]
+        tops = {name.split("/", 1)[0] for name in names}
+        self.prefix = f"{tops.pop()}/" if len(tops) == 1 and all("/" in name for name in names) else ""
+
+    def rel_path(self, name):
+        name = name[2:] if name.startswith("./") else name
+        return name[len(self.prefix):]
+
+    def index(self, roots=("",)):
+        # Same as index_triage(), for the members of the archive
+        index = {}
+        for name, (info, size, mtime_ns, position) in self.members.items():
+            rel_path = self.rel_path(name)
+            if any(not root or rel_path.startswith(root + "/") for root in roots):
+                index[f"{self.path}{ARCHIVE_SEPARATOR}{name}"] = (rel_path, size, mtime_ns)
+
+        return index
+
+    def open(self, name):
+        # Returns a binary stream of the member as stored in the archive
+        info = self.members[name][0]
+        if isinstance(self.archive, zipfile.ZipFile):
+            return self.archive.open(info)
+
+        return self.archive.extractfile(info)
+
+    def head(self, name):
+        if name not in self.heads:
+            with self.open(name) as f:
+                self.heads[name] = f.read(FINGERPRINT_SIZE)
+
+        return self.heads[name]
+
+    def open_rel(self, rel_path):
+        for name in self.members:
+            if self.rel_path(name) == rel_path:
+                return self.open(name)
+
+        raise KeyError(rel_path)
+
+
+def get_archive(path):
+    # Opens each triage archive once per run, since listing a compressed tar means reading all of it
+    with ARCHIVES_LOCK:
+        if path not in ARCHIVES:
+            ARCHIVES[path] = TriageArchive(path)
+
+        return ARCHIVES[path]
+
+
+def split_member(file):
+    # Returns the archive and member name of a log read from a triage archive, or None for a log on disk
+    archive_path, sep, name = file.partition(ARCHIVE_SEPARATOR)
+    if sep and archive_path in ARCHIVES:
+        return ARCHIVES[archive_path], name
+
+    return None
+
+
+def open_raw(file):
+    # Returns a binary stream of the log as stored, whether on disk or in a triage archive
+    member = split_member(file)
+    if member:
+        archive, name = member
+        return archive.open(name)
+
+    return open(file, 'rb')
+
+
+def log_stat(file):
+    # Returns the size and mtime (in seconds) of the log, whether on disk or in a triage archive
+    member = split_member(file)
+    if member:
+        archive, name = member
+        info, size, mtime_ns, position = archive.members[name]
+        return size, mtime_ns / 10 ** 9
+
+    stat = os.stat(file)
+    return stat.st_size, stat.st_mtime
+
+
+def log_exists(file):
+    member = split_member(file)
+    if member:
+        archive, name = member
+        return name in archive.members
+
+    return os.path.isfile(file)
+
+
+def ordered_logs(log_sets):
+    # Lists the (log type, file) to read, with archive members in archive order so each archive is only read once
+    def position(log):
+        member = split_member(log[1])
+        return member[0].members[member[1]][3] if member else 0
+
+    return sorted(((log_type, file) for log_type, all_files in log_sets for file in all_files), key=position)
+
+
+def config_roots(config_file):
+    # Top-most folders of the triage output that the configured paths can match in
+    roots = set()
+    for module in config_file.keys():
+        for filetype in config_file[module].keys():
+            for sub_path in config_file[module][filetype]:
+                static = re.split(r"[*?\[]", sub_path, maxsplit=1)[0]
+                roots.add(static.rsplit("/", 1)[0] if "/" in static else "")
+
+    # Nested roots are already covered by their parent
+    return tuple(root for root in roots
+                 if not any(other != root and (other == "" or root.startswith(other + "/")) for other in roots))
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(sub_path):
+    """
+    Paths in the configuration files match the file itself, its rotations (e.g. var/log/messages matches messages,
+    messages-20211003 and messages.1.gz) and every file inside a folder of that name (e.g. var/log/audit). Paths
+    containing glob characters are matched as globs against the path relative to the triage output.
+    """
+    sub_path = sub_path.strip("/")
+    if re.search(r"[*?\[]", sub_path):
+        return re.compile(fnmatch.translate(sub_path))
+
+    return re.compile(rf"^{re.escape(sub_path)}(?:[.\-][^/]*)?$|^{re.escape(sub_path)}/.+$")
+
+
+def open_log(file):
+    # Returns a binary stream of the log, decompressing .gz rotations on the fly
+    if split_member(file):
+        raw = open_raw(file)
+        return gzip.GzipFile(fileobj=raw, mode='rb') if file.endswith(".gz") else raw
+
+    if file.endswith(".gz"):
+        return gzip.open(file, 'rb')
+
+    return open(file, 'rb')
+
+
+def count_lines(file):
+    count = 0
+    last = b"\n"
+    if not file.endswith(".gz") and not split_member(file) and os.path.getsize(file) > 0:
+        # Plain files are mapped and scanned in large blocks instead of being copied through read()
+        with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start in range(0, len(mm), COUNT_BLOCK_SIZE):
+                count += mm[start:start + COUNT_BLOCK_SIZE].count(b"\n")
+            last = mm[-1:]
+
+    else:
+        with open_log(file) as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                count += chunk.count(b"\n")
+                last = chunk[-1:]
+
+    # A final line without a trailing newline is still a line
+    if last != b"\n":
+        count += 1
+
+    return count
+
+
+def load_line_cache():
+    try:
+        with open(LINE_COUNT_CACHE, "r") as f:
+            return json.load(f)
+
+    except (OSError, ValueError):
+        return {}
+
+
+def save_line_cache(entries):
+    # Merges the new entries into the cache on disk, as parallel triage jobs may be saving their own counts
+    with LINE_COUNT_LOCK:
+        cache = load_line_cache()
+        cache.update(entries)
+        try:
+            os.makedirs(os.path.dirname(LINE_COUNT_CACHE), exist_ok=True)
+            tmp_path = LINE_COUNT_CACHE + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, LINE_COUNT_CACHE)
+
+        except OSError as e:
+            print(e)
+            print(f"Unable to save line counts to {LINE_COUNT_CACHE}")
+
+
+def file_key(file, index=None):
+    if index and file in index:
+        rel_path, size, mtime = index[file]
+        return [size, mtime]
+
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def count_all_lines(files, workers, known=None, index=None):
+    """
+    Returns the line count of each file. Counts are cached per (path, size, mtime) so unchanged files are never read
+    twice, and the remaining files are spread across a process pool. Counts already worked out elsewhere (e.g. while
+    decompressing) can be passed in known to be cached as well. Sizes and mtimes are taken from the triage index when
+    one is given.
+    """
+    cache = load_line_cache()
+    new_entries = {}
+    counts = {}
+    missing = []
+    for file in files:
+        entry = cache.get(file)
+        if entry and entry[:2] == file_key(file, index):
+            counts[file] = entry[2]
+
+        elif known and file in known:
+            counts[file] = known[file]
+            new_entries[file] = file_key(file, index) + [known[file]]
+
+        else:
+            missing.append(file)
+
+    if len(missing) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+            results = list(executor.map(count_lines, missing))
+
+    else:
+        results = [count_lines(file) for file in missing]
+
+    for file, count in zip(missing, results):
+        counts[file] = count
+        new_entries[file] = file_key(file, index) + [count]
+
+    if new_entries:
+        save_line_cache(new_entries)
+
+    return counts
+
+
+def decompress_log(file, spool_dir):
+    # Decompresses a .gz rotation into the spool directory and counts its lines in the same pass
+    out_path = os.path.join(spool_dir, os.path.basename(file)[:-3])
+    count = 0
+    last = b"\n"
+    with gzip.open(file, 'rb') as f_in, open(out_path, 'wb') as f_out:
+        for chunk in iter(lambda: f_in.read(CHUNK_SIZE), b""):
+            count += chunk.count(b"\n")
+            last = chunk[-1:]
+            f_out.write(chunk)
+
+    if last != b"\n":
+        count += 1
+
+    return out_path, count
+
+
+def spool_rotations(all_files, spool_dir, workers):
+    """
+    Filebeat cannot read .gz files directly, so compressed rotations are decompressed into a spool directory outside
+    of the triage output. Each worker holds at most one chunk in memory at a time.
+    """
+    gz_files = [file for file in all_files if file.endswith(".gz")]
+    if not gz_files:
+        return {}
+
+    # Rotations of different logs may share a basename, so each one gets its own subdirectory
+    dest_dirs = []
+    for i in range(len(gz_files)):
+        dest_dir = os.path.join(spool_dir, str(i))
+        os.makedirs(dest_dir, exist_ok=True)
+        dest_dirs.append(dest_dir)
+
+    print(f"Decompressing {len(gz_files)} rotated log(s) to {spool_dir}...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(decompress_log, gz_files, dest_dirs)
+        return dict(zip(gz_files, results))
+
+
+def fingerprint(file, size):
+    member = split_member(file)
+    if member:
+        # Members of a compressed tar are only read front to back, so their heads are kept from listing the archive
+        archive, name = member
+        return hashlib.sha1(archive.head(name)[:size]).hexdigest()
+
+    with open_log(file) as f:
+        return hashlib.sha1(f.read(size)).hexdigest()
+
+
+def merge_ranges(ranges):
+    # Sorts byte ranges and joins the ones that touch or overlap
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+
+        else:
+            merged.append([start, end])
+
+    return merged
+
+
+def subtract_range(ranges, start, end):
+    # Yields what is left of each byte range once [start, end) is taken out of it
+    for range_start, range_end in ranges:
+        if range_end <= start or range_start >= end:
+            yield range_start, range_end
+            continue
+
+        if range_start < start:
+            yield range_start, start
+        if range_end > end:
+            yield end, range_end
+
+
+class LogProgress:
+    """
+    How far each log of a triage output has been uploaded (or stored), tracked as the byte offset and number of lines
+    done plus the byte ranges of documents that failed. IngestManifest and SearchIndex share it, so that
+    generate_actions(), the async pipeline and record_results() resume from and update either one the same way.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.pending = {}
 
-    return result
+    def begin(self, file, offset, lines):
+        failed = self.files.get(file, {}).get("failed", []) if offset else []
+        self.files[file] = {"offset": offset, "lines": lines, "failed": failed, "fingerprint": "", "fingerprint_size": 0}
+        self.pending[file] = {}
 
+    def plan(self, files):
+        # Records the logs a run is about to upload, so one that crashes before reaching some of them can be resumed
+        for file in files:
+            if file not in self.files:
+                self.files[file] = {"offset": 0, "lines": 0, "failed": [], "fingerprint": "", "fingerprint_size": 0}
 
-def check_registry_folder(filebeat_dir, basename):
+    def failed_ranges(self, file):
+        return [list(failed) for failed in self.files.get(file, {}).get("failed", [])]
+
+    def failed_count(self):
+        return sum(len(entry.get("failed", [])) for entry in self.files.values())
+
+    def mark_read(self, file, end):
+        # Records where the log ended, so an upload interrupted before all of it was indexed is known to be unfinished
+        self.files[file]["read"] = end
+
+    def unfinished(self, file):
+        # Whether a run planned to upload the log but left failed ranges or lines that were never indexed
+        entry = self.files.get(file)
+        return entry is not None and bool(entry.get("failed") or entry["offset"] < entry.get("read", math.inf))
+
+    def mark_shipped(self, file, start, end, lines):
+        """
+        Records that the lines in [start, end) were indexed. Batches may complete out of order, so the saved offset
+        only moves forward once every range before it has been indexed too. Ranges before the saved offset are failed
+        ranges that were sent again.
+        """
+        entry = self.files[file]
+        if start < entry["offset"]:
+            entry["failed"] = [[failed_start, failed_end] for failed_start, failed_end in
+                               subtract_range(entry["failed"], start, end)]
+            entry["lines"] += lines
+            return
+
+        pending = self.pending[file]
+        pending[start] = (end, lines)
+        while entry["offset"] in pending:
+            end, lines = pending.pop(entry["offset"])
+            entry["offset"] = end
+            entry["lines"] += lines
+
+    def mark_failed(self, file, start, end):
+        # Records that the documents in [start, end) could not be indexed, and moves past them like indexed ones
+        entry = self.files[file]
+        if start < entry["offset"]:
+            return
+
+        entry["failed"] = merge_ranges(entry["failed"] + [[start, end]])
+        self.mark_shipped(file, start, end, 0)
+
+
+def update_fingerprints(files):
+    # Fingerprints the first bytes of each log done so far, up to FINGERPRINT_SIZE, before its progress is saved
+    for file, entry in files.items():
+        if entry["fingerprint_size"] < min(entry["offset"], FINGERPRINT_SIZE):
+            entry["fingerprint_size"] = min(entry["offset"], FINGERPRINT_SIZE)
+            entry["fingerprint"] = fingerprint(file, entry["fingerprint_size"])
+
+
+class IngestManifest(LogProgress):
+    """
+    Persistent record of how much of each log in a triage output has been uploaded to an index. Each file is stored
+    with the byte offset and number of lines already shipped, plus a fingerprint of its first bytes so a file that was
+    replaced or truncated since the last run is uploaded again from the start. The byte ranges of documents that
+    failed to upload are recorded too, so a later run only sends those again rather than the rest of the file.
+    """
+
+    def __init__(self, index_name, name):
+        super().__init__()
+        self.path = os.path.join(MANIFEST_DIR, index_name, f"{name}.json")
+        self.lock = threading.Lock()  # A checkpoint written from a worker thread may overlap the last save
+        try:
+            with open(self.path, "r") as f:
+                self.files = json.load(f)["files"]
+
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def reset(self):
+        print(f"Discarding upload state in {self.path}")
+        self.files = {}
+        self.pending = {}
+
+    def resume_point(self, file):
+        # Returns the byte offset and number of lines of the file already uploaded
+        entry = self.files.get(file)
+        if entry and entry["offset"] and entry["fingerprint"] == fingerprint(file, entry["fingerprint_size"]):
+            return entry["offset"], entry["lines"]
+
+        return 0, 0
+
+    def adopt(self, file):
+        """
+        Carries the upload state of a log over to a new file holding the same lines, e.g. messages renamed to
+        messages.1 (or compressed to messages.2.gz) by log rotation, so the rotation is not uploaded again. Returns
+        whether a log with the same leading bytes was found. A log only planned for upload has no state to keep yet,
+        and the state is only taken from a log that no longer holds those bytes, so a copy of a log is uploaded too.
+        """
+        if self.files.get(file, {}).get("offset"):
+            return False
+
+        for other, entry in list(self.files.items()):
+            size = entry["fingerprint_size"]
+            if size and entry["fingerprint"] == fingerprint(file, size) and not (log_exists(other) and entry["fingerprint"] == fingerprint(other, size)):
+                self.files[file] = dict(entry, failed=[list(failed) for failed in entry.get("failed", [])])
+                return True
+
+        return False
+
+    def save(self):
+        self.write(self.files)
+
+    def snapshot(self):
+        # Copies the upload state, so it can be written from another thread while the upload goes on
+        return {file: dict(entry, failed=[list(failed) for failed in entry.get("failed", [])])
+                for file, entry in self.files.items()}
+
+    def keep_fingerprints(self, files):
+        # Carries the fingerprints taken while writing a snapshot over to the logs still read up to that far
+        for file, written in files.items():
+            entry = self.files.get(file)
+            if entry and entry["fingerprint_size"] < written["fingerprint_size"] <= entry["offset"]:
+                entry["fingerprint_size"] = written["fingerprint_size"]
+                entry["fingerprint"] = written["fingerprint"]
+
+    def write(self, files):
+        update_fingerprints(files)
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with self.lock:
+                with open(tmp_path, "w") as f:
+                    json.dump({"files": files}, f)
+                os.replace(tmp_path, self.path)
+
+        except OSError as e:
+            print(e)
+            print(f"Unable to save upload state to {self.path}")
+
+
+class SeenLines:
+    """
+    Remembers the lines of a triage output in a scalable Bloom filter, so a line copied into several rotations (or
+    collected twice) is only uploaded once. Lines are compared with surrounding whitespace stripped, and memory grows
+    by a few bytes per unique line rather than with the length of the lines. Every filter added as the last one fills
+    up has double the capacity and half the false positive rate, so fewer than DEDUP_ERROR_RATE of the unique lines
+    are ever mistaken for duplicates. The bits of a line are derived from a single digest by double hashing, and at
+    most DEDUP_MAX_HASHES of them are probed per filter, trading some memory for fewer probes in pure Python.
+    """
+
+    def __init__(self, capacity=DEDUP_CAPACITY, error_rate=DEDUP_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = []
+        self.duplicates = 0
+        self.grow()
+
+    def grow(self):
+        capacity = self.capacity * 2 ** len(self.filters)
+        error_rate = self.error_rate / 2 ** (len(self.filters) + 1)
+        hashes = max(1, min(DEDUP_MAX_HASHES, round(-math.log2(error_rate))))
+        size = math.ceil(-hashes * capacity / math.log(1 - error_rate ** (1 / hashes)))
+        self.filters.append((bytearray((size + 7) // 8), size, hashes))
+        self.room = capacity
+
+    def is_duplicate(self, line):
+        # Returns True if the line was seen before, and remembers it otherwise
+        digest = hashlib.blake2b(line.strip(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for bits, size, hashes in self.filters:
+            positions = [position % size for position in range(h1, h1 + hashes * h2, h2)]
+            if all(bits[position >> 3] >> (position & 7) & 1 for position in positions):
+                self.duplicates += 1
+                return True
+
+        if not self.room:
+            self.grow()
+            bits, size, hashes = self.filters[-1]
+            positions = [position % size for position in range(h1, h1 + hashes * h2, h2)]
+
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        self.room -= 1
+
+        return False
+
+
+def prime_seen_lines(seen, manifest):
+    # Remembers the lines uploaded by earlier runs, so their copies in other logs are not uploaded now
+    for file in list(manifest.files):
+        if not log_exists(file):
+            continue
+
+        offset, lines = manifest.resume_point(file)
+        failed = manifest.failed_ranges(file) if offset else []
+        for start, end, line in read_lines(file):
+            if start >= offset:
+                break
+
+            # Lines that failed to upload are sent again, so they must not count as seen
+            if not any(failed_start <= start < failed_end for failed_start, failed_end in failed):
+                seen.is_duplicate(line)
+
+
+def adopt_rotations(manifest, files):
+    """
+    Carries the upload state of logs renamed (or compressed) by log rotation since the last run over to their new
+    names, so their lines are not uploaded again. It runs before any log is read, as by then the old name of a
+    rotation may hold a new log whose state replaces the old one. Returns the files that took over a saved state.
+    """
+    adopted = set()
+    for file in files:
+        if manifest.adopt(file):
+            print(f"{file} holds the lines of a log already uploaded, resuming from its saved state")
+            adopted.add(file)
+
+    return adopted
+
+
+def spool_unique(file, dest_dir, seen, offset=0):
+    """
+    Writes the lines of the log from the given offset that were not seen before in the triage output (or all of
+    them without seen) to the spool directory, for Filebeat to upload. Returns the spooled file, its number of lines
+    and the offset read up to.
+    """
+    out_path = os.path.join(dest_dir, os.path.basename(file[:-3] if file.endswith(".gz") else file))
+    count = 0
+    end = offset
+    with open(out_path, 'wb') as f_out:
+        for start, end, line in read_lines(file, offset):
+            if seen is None or not seen.is_duplicate(line):
+                f_out.write(line + b"\n")
+                count += 1
+
+    return out_path, count, end
+
+
+def check_registry_folder(filebeat_dir, basename, reset=False):
     data_path = os.path.join(filebeat_dir, "data")
     base_path = os.path.join(data_path, basename)
 
@@ -101,7 +997,7 @@ def check_registry_folder(filebeat_dir, basename):
         try:
             print("Data path not found!")
             print(f"Creating new directory, \"data\" in {filebeat_dir}")
-            os.makedirs(data_path, mode=664)
+            os.makedirs(data_path, mode=0o775)
 
         except Exception as e:
             print(e)
@@ -110,23 +1006,24 @@ def check_registry_folder(filebeat_dir, basename):
             sys.exit(1)
 
     # Check if the folder that saves the state of the logs for the specified triage output exists
-    for dirs in os.listdir(data_path):
-        if basename in dirs:
-            if os.path.isdir(base_path):
-                try:
-                    print(f"The directory, \"{basename}\" already exists in {data_path}, removing...")
-                    shutil.rmtree(base_path)
-
-                except Exception as e:
-                    print(e)
-                    print("The directory, \"" + basename + "\" cannot be deleted. Please check if the directory is in use")
-                    sys.exit(1)
+    if os.path.isdir(base_path):
+        if not reset:
+            # Filebeat's registry remembers how far each log was read, so only new lines are uploaded
+            print(f"The directory, \"{basename}\" already exists in {data_path}, resuming from its saved state...")
+            return os.path.join(".", basename)
 
-                break
+        try:
+            print(f"The directory, \"{basename}\" already exists in {data_path}, removing...")
+            shutil.rmtree(base_path)
+
+        except Exception as e:
+            print(e)
+            print("The directory, \"" + basename + "\" cannot be deleted. Please check if the directory is in use")
+            sys.exit(1)
 
     try:
         print(f"Creating new directory, \"{basename}\" in {data_path}")
-        os.makedirs(base_path, mode=664)
+        os.makedirs(base_path, mode=0o775)
 
     except Exception as e:
         print(e)
@@ -137,12 +1034,11 @@ def check_registry_folder(filebeat_dir, basename):
     return os.path.join(".", basename)
 
 
-def build_cmd(abs_path, filebeat_dir, preset_cmd, config_file):
-    total_expected_doc_count = 0
+def build_cmd(abs_path, filebeat_dir, preset_cmd, profile, spool_dir, workers, index=None, manifest=None, metrics=None, window=None, seen=None):
     module_list = []
     module_flag = "-modules="
 
-    for module in config_file.keys():
+    for module, module_d in profile.modules:
         module_list.append(module)
 
     print("Modules found: " + str(module_list))
@@ -151,83 +1047,241 @@ def build_cmd(abs_path, filebeat_dir, preset_cmd, config_file):
     module_flag += ",".join([str(m) for m in module_list])
     preset_cmd.append(module_flag)
 
-    module_dir = os.path.join(filebeat_dir, "modules.d")
-    for module in module_list:
-        not_found = True
-        for module_d in os.listdir(module_dir):
-            if module in module_d:  # Check if filebeat supports the module specified in the configuration file
-                not_found = False
-                print("Configuration file found: " + module_d)
+    inputs, total_expected_doc_count, shipped = collect_filebeat_logs(abs_path, filebeat_dir, profile, spool_dir, workers, index, manifest, metrics, window, seen)
+    for module, filetype, ship_files, sources in inputs:
+        all_files = str(ship_files)
+        system_path = f"{module}.{filetype}.var.paths={all_files}"
+        preset_cmd.append("-M")
+        preset_cmd.append(system_path)
+        if sources:
+            preset_cmd.append("-M")
+            preset_cmd.append(f"{module}.{filetype}.input.processors={json.dumps(source_fields(sources))}")
 
-                # Retrieve log type from specified module
-                log_types_list = []
-                for log_type in config_file[module].keys():
-                    log_types_list.append(log_type)
-                print("Log types found: " + str(log_types_list))
+    preset_cmd.append("--once")
 
-                # Retrieve file paths from each filetype
-                for filetype in config_file[module].keys():
-                    file_path_list = config_file[module][filetype]
-                    all_files = grab_logs(abs_path, file_path_list)
-                    print("Path list of log files found:")
-                    pprint.pp(all_files)
+    return preset_cmd, total_expected_doc_count, shipped
 
-                    expected_doc_count = 0
-                    for file in all_files:
-                        with open(file, 'r') as f:
-                            count = len(f.readlines())
 
-                        print(f"Total lines in {os.path.basename(file)}: {count}")
-                        expected_doc_count += count
+def source_fields(sources):
+    # Filebeat processors adding fields.source_path to the events read from a spooled copy, so they still point to the log in the triage output
+    return [{"add_fields": {"when": {"equals": {"log.file.path": ship_file}}, "fields": {"source_path": file}}}
+            for ship_file, file in sources.items()]
 
-                    total_expected_doc_count += expected_doc_count
 
-                    all_files = str(all_files)
-                    system_path = f"{module}.{filetype}.var.paths={all_files}"
-                    preset_cmd.append("-M")
-                    preset_cmd.append(system_path)
+def collect_filebeat_logs(abs_path, filebeat_dir, profile, spool_dir, workers, index=None, manifest=None, metrics=None, window=None, seen=None):
+    """
+    Finds the logs of each log type for Filebeat, spooling the rotations and filtered copies it reads instead of the
+    originals. Returns the (module, filetype, files, sources) read by Filebeat, where sources maps each spooled copy
+    to its log, the number of lines expected to be uploaded and a (file, ship_file, count, offset, lines, done) entry
+    for every log shipped.
+    """
+    metrics = metrics or StageMetrics(os.path.basename(abs_path))
+    total_expected_doc_count = 0
+    shipped = []
+    inputs = []
 
-        if not_found:
+    module_dir = os.path.join(filebeat_dir, "modules.d")
+    for module, module_d in profile.modules:
+        # Check if filebeat supports the module specified in the configuration file
+        if module_d is None:
             print(f"The module, \"{module}\" cannot be found in {module_dir}")
             sys.exit(1)
 
-    preset_cmd.append("--once")
-
-    return preset_cmd, total_expected_doc_count
-
-
-def grab_logs(abs_path, file_path_list):
+        print("Configuration file found: " + module_d)
+
+        # Retrieve log type from specified module
+        log_types = [log_type for log_type in profile.log_types if log_type.module == module]
+        print("Log types found: " + str([log_type.filetype for log_type in log_types]))
+
+        # Retrieve file paths from each filetype
+        for log_type in log_types:
+            filetype = log_type.filetype
+            with metrics.stage("discovery"):
+                all_files = grab_logs(abs_path, log_type, index)
+            print("Path list of log files found:")
+            pprint.pp(all_files)
+
+            # Rotated .gz files never change, so those already uploaded to this index are left out. A rotation compressed
+            # since the last run takes over the state of its log, and only the lines that log had left are spooled
+            adopted = adopt_rotations(manifest, all_files) if manifest else set()
+            resume_points = {}
+            for file in list(all_files):
+                resume_points[file] = manifest.resume_point(file) if manifest else (0, 0)
+                if file.endswith(".gz") and resume_points[file][1] and file not in adopted:
+                    print(f"{file} was already uploaded. Skipping...")
+                    all_files.remove(file)
+
+            # Logs partly inside the time window are spooled with only the lines inside it
+            windowed = {}
+            if window:
+                with metrics.stage("time_filter"):
+                    all_files, windowed = apply_window(all_files, os.path.join(spool_dir, f"{module}.{filetype}.window"), workers, window)
+                metrics.add("time_filter", lines=sum(count for ship_file, count in windowed.values()))
+
+            # With duplicate lines dropped, every log is spooled with only the lines not seen before
+            unique = {}
+            partial = all_files if seen else [file for file in all_files if file in adopted and file.endswith(".gz")]
+            if partial:
+                dedup_dir = os.path.join(spool_dir, f"{module}.{filetype}.unique")
+                with metrics.stage("dedup"):
+                    for i, file in enumerate(partial):
+                        dest_dir = os.path.join(dedup_dir, str(i))
+                        os.makedirs(dest_dir, exist_ok=True)
+                        source, offset = (windowed[file][0], 0) if file in windowed else (file, resume_points[file][0])
+                        unique[file] = spool_unique(source, dest_dir, seen, offset)
+                metrics.add("dedup", lines=sum(count for ship_file, count, end in unique.values()))
+
+            whole_files = [file for file in all_files if file not in windowed and file not in unique]
+            with metrics.stage("decompression"):
+                spooled = spool_rotations(whole_files, os.path.join(spool_dir, f"{module}.{filetype}"), workers)
+            known = {file: count for file, (ship_file, count) in spooled.items()}
+            metrics.add("decompression", size=sum(os.path.getsize(ship_file) for ship_file, count in spooled.values()),
+                        lines=sum(known.values()))
+
+            with metrics.stage("line_counting"):
+                counts = count_all_lines(whole_files, workers, known, index)
+            metrics.add("line_counting", size=sum(file_key(file, index)[0] for file in whole_files),
+                        lines=sum(counts.values()))
+
+            spooled.update(windowed)
+            counts.update({file: count for file, (ship_file, count) in windowed.items()})
+            spooled.update({file: (ship_file, count) for file, (ship_file, count, end) in unique.items()})
+            counts.update({file: count for file, (ship_file, count, end) in unique.items()})
+
+            expected_doc_count = 0
+            ship_files = []
+            sources = {}
+            for file in all_files:
+                ship_file = spooled[file][0] if file in spooled else file
+                count = counts[file]
+
+                # Filebeat's registry resumes logs that grew since the last run, so only new lines are expected
+                offset, lines = resume_points[file]
+                done = (os.path.getsize(ship_file), count)
+                if file in unique:
+                    # The spooled copy only holds the new (unique) lines, so Filebeat reads all of it
+                    done = (unique[file][2], lines + count)
+                    offset, lines = 0, 0
+                    if not count:
+                        print(f"No new{' unique' if seen else ''} lines in {os.path.basename(file)}. Skipping...")
+                        if manifest:
+                            manifest.begin(file, *done)
+                        continue
+
+                print(f"Total lines in {os.path.basename(file)}: {count}")
+                if lines:
+                    print(f"Lines already uploaded from {os.path.basename(file)}: {lines}")
+                expected_doc_count += count - lines
+                ship_files.append(ship_file)
+                if ship_file != file:
+                    sources[ship_file] = file
+                shipped.append((file, ship_file, count, offset, lines, done))
+
+            total_expected_doc_count += expected_doc_count
+            inputs.append((module, filetype, ship_files, sources))
+
+    return inputs, total_expected_doc_count, shipped
+
+
+def grab_logs(abs_path, log_type, index=None):
     # Grab logs
+    if index is None:
+        index = index_triage(abs_path)
+
     all_files = []
-    for sub_path in file_path_list:
-        print("Retrieving paths containing " + sub_path)
-        full_filepath = os.path.join(abs_path, sub_path)
-        full_sub_path, filename = os.path.split(full_filepath)
-        full_filepath_list = find(filename, full_sub_path)
+    seen = set()
+    for sub_path, pattern in zip(log_type.paths, log_type.patterns):
+        print("Retrieving paths matching " + sub_path)
+        full_filepath_list = sorted(path for path, (rel_path, size, mtime) in index.items() if pattern.match(rel_path))
 
         if not full_filepath_list:
             print("No paths were found...")
 
+        # Rotated .gz files are kept compressed and streamed later, so a plain file and its .gz are the same log
         for filepath in full_filepath_list:
+            log_name = filepath[:-3] if filepath.endswith(".gz") else filepath
+            if log_name in seen:
+                print(log_name + " exists in results. Skipping...")
+                continue
+
+            seen.add(log_name)
             all_files.append(filepath)
 
     return all_files
 
 
-def connect_es(host):
+def find_filebeat_dir(path):
+    not_found = True
+    filebeat_dir = ''
+    if path:
+        filebeat_dir = path
+        if os.path.isdir(filebeat_dir):
+            print("Filebeat directory set to " + path)
+            not_found = False
+
+    else:
+        for dirs in os.listdir("."):
+            if "filebeat" in dirs and "linux" in dirs:
+                default_path = os.path.join(".", dirs)
+                if os.path.isdir(default_path):
+                    filebeat_dir = default_path
+                    not_found = False
+                    break
+
+    if not_found:
+        print("Filebeat directory not found, please ensure that filebeat is downloaded in the current working directory or its specified directory path is relative to the current working directory.")
+        print("Use the '-p' option if located in another folder")
+        sys.exit(1)
+
+    return filebeat_dir
+
+
+def split_hosts(values):
+    # Returns the URLs given with -u, which may be repeated or hold several URLs separated by commas
+    return [host.strip() for value in values or [] for host in value.split(",") if host.strip()]
+
+
+def connect_es(hosts, pool_size=DEFAULT_POOL_SIZE, sniff=False):
+    """
+    Creates the Elasticsearch client shared by every stage and triage output of a run. Its connections are kept
+    alive and pooled, so pool_size should cover the bulk requests that can be in flight at the same time. Requests
+    are spread over the nodes in round-robin order; a node that stops responding is marked dead and skipped (and
+    its request retried on the next node) until it is tried again after a growing timeout.
+    """
+    if isinstance(hosts, str):
+        hosts = [hosts]
+
+    options = {"sniff_on_start": sniff}
+    if ES_CLIENT_MAJOR < 8:
+        options.update(timeout=ES_REQUEST_TIMEOUT, maxsize=pool_size, dead_timeout=ES_DEAD_TIMEOUT)
+        if sniff:
+            options.update(sniff_on_connection_fail=True, sniffer_timeout=SNIFF_INTERVAL)
+
+    else:
+        # The 7.x client doubles a dead node's timeout up to 32 times over, which the backoff cap keeps the same
+        options.update(request_timeout=ES_REQUEST_TIMEOUT, connections_per_node=pool_size,
+                       dead_node_backoff_factor=ES_DEAD_TIMEOUT, max_dead_node_backoff=ES_DEAD_TIMEOUT * 32)
+        if sniff:
+            options.update(sniff_on_node_failure=True, min_delay_between_sniffing=SNIFF_INTERVAL)
+
     try:
-        es = Elasticsearch([host], timeout=60)
+        # Rejections (429) are not retried by the client, as the ingest engines back off and resend those documents
+        es = Elasticsearch(hosts, retry_on_timeout=True, retry_on_status=(502, 503, 504), max_retries=max(ES_MAX_RETRIES, len(hosts)), **options)
 
     except Exception as e:
         print("Connection failed, please check if specified URL is valid")
         print(f"Error: {e}")
         sys.exit(1)
 
-    print("Connection established")
+    print(f"Connection established ({len(hosts)} node(s){', sniffing for more' if sniff else ''})")
     return es
 
 
-def create_index(es, index_name):
+def create_index(es, index_name, mappings=None):
+    # Indices already checked or created during this run are not checked again
+    if index_name in KNOWN_INDICES:
+        return True
+
     print(f"Creating index: {index_name}")
     setting = {
         "settings": {
@@ -235,10 +1289,13 @@ def create_index(es, index_name):
             # "index.mapping.ignore_malformed": "true",
         }
     }
+    if mappings:
+        setting["mappings"] = mappings
 
     try:
         if es.indices.exists(index=index_name):
             print("Index already exists, proceeding to upload logs...")
+            KNOWN_INDICES.add(index_name)
 
         else:
             response = es.indices.create(index=index_name, body=setting, ignore=400)
@@ -246,6 +1303,7 @@ def create_index(es, index_name):
             if 'acknowledged' in response:
                 if response['acknowledged']:
                     print("Index Mapping success for index: "+response['index'])
+                    KNOWN_INDICES.add(index_name)
                     return True
 
             # catch API error response
@@ -257,6 +1315,1376 @@ def create_index(es, index_name):
         print(f"Connection error: {e}")
 
 
+def bulk_load_state_path(index_name):
+    return os.path.join(MANIFEST_DIR, index_name, "bulk_load.json")
+
+
+@contextlib.contextmanager
+def bulk_load(es, index_name, force_merge=None):
+    """
+    Turns off refreshes and replicas of the index while an upload runs, so bulk requests neither trigger periodic
+    refreshes nor wait on replica shards. The original settings are restored afterwards, even if the upload fails,
+    then the index is refreshed and optionally force-merged. The original settings are saved to a file first, so a
+    run that was killed before restoring them is restored by the next one rather than taking -1 and 0 as originals.
+    """
+    state_path = bulk_load_state_path(index_name)
+    try:
+        with open(state_path, "r") as f:
+            original = json.load(f)
+        print(f"Restoring the settings saved by an interrupted bulk load from {state_path}")
+
+    except (OSError, ValueError):
+        original = None
+
+    applied = False
+    try:
+        if original is None:
+            response = es.indices.get_settings(index=index_name)
+            current = next(iter(response.values()))["settings"]["index"]
+            original = {setting: current.get(setting) for setting in BULK_LOAD_SETTINGS}
+            os.makedirs(os.path.dirname(state_path), exist_ok=True)
+            with open(state_path, "w") as f:
+                json.dump(original, f)
+
+        es.indices.put_settings(index=index_name, body={"index": BULK_LOAD_SETTINGS})
+        print(f"Bulk load settings applied to {index_name}: {BULK_LOAD_SETTINGS}")
+        applied = True
+
+    except Exception as e:
+        print(f"Unable to apply the bulk load settings, uploading with the current settings: {e}")
+
+    try:
+        yield
+
+    finally:
+        if applied:
+            restore_settings(es, index_name, original, state_path, force_merge)
+
+
+def restore_settings(es, index_name, original, state_path, force_merge=None):
+    try:
+        # Settings that were not set on the index are reset to their defaults with null
+        es.indices.put_settings(index=index_name, body={"index": original})
+        os.remove(state_path)
+        print(f"Settings of {index_name} restored: {original}")
+
+    except Exception as e:
+        print(f"Unable to restore the settings of {index_name}: {e}")
+        print(f"They are kept in {state_path} and will be restored by the next --bulk-load upload to {index_name}")
+        return
+
+    try:
+        es.indices.refresh(index=index_name)
+        if force_merge:
+            print(f"Force merging {index_name} down to {force_merge} segment(s)...")
+            es.indices.forcemerge(index=index_name, max_num_segments=force_merge, request_timeout=FORCE_MERGE_TIMEOUT)
+
+    except Exception as e:
+        print(f"Unable to refresh or force merge {index_name}: {e}")
+
+
+def parse_window(since, until):
+    # Returns the --since/--until window as UTC epoch seconds; times without a timezone are taken as UTC
+    window = []
+    for value in (since, until):
+        if value is None:
+            window.append(None)
+            continue
+
+        try:
+            moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+        except ValueError:
+            print(f"Invalid time: {value}. Please use the format YYYY-MM-DD[ HH:MM:SS[+HH:MM]]")
+            sys.exit(1)
+
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        window.append(moment.timestamp())
+
+    if window == [None, None]:
+        return None
+
+    return tuple(window)
+
+
+def time_reference(file):
+    # Syslog timestamps have no year, so it is taken from the log's mtime (lines from a later month are from last year)
+    mtime = time.gmtime(log_stat(file)[1])
+    return mtime.tm_year, mtime.tm_mon
+
+
+@functools.lru_cache(maxsize=1024)
+def file_time_reference(file):
+    # Cached per log, as every document built from it needs the reference
+    return time_reference(file)
+
+
+@functools.lru_cache(maxsize=4096)
+def day_start(year, month, day):
+    return calendar.timegm((year, month, day, 0, 0, 0))
+
+
+def line_timestamp(line, reference):
+    # Returns the UTC epoch of a syslog, RFC 3339 or auditd line, or None if it has no recognisable timestamp
+    try:
+        month = MONTHS.get(line[:3])
+        if month and line[3:4] == b" ":
+            year = reference[0] if month <= reference[1] else reference[0] - 1
+            return day_start(year, month, int(line[4:6])) + int(line[7:9]) * 3600 + int(line[10:12]) * 60 + int(line[13:15])
+
+        if line[4:5] == b"-" and line[:4].isdigit():
+            match = ISO_TIME_PATTERN.match(line)
+            if match:
+                moment = datetime.datetime.fromisoformat(match.group(1).decode().replace("Z", "+00:00"))
+                if moment.tzinfo is None:
+                    moment = moment.replace(tzinfo=datetime.timezone.utc)
+                return moment.timestamp()
+
+        match = AUDIT_TIME_PATTERN.search(line)
+        if match:
+            return float(match.group(1))
+
+    except ValueError:
+        pass
+
+    return None
+
+
+def probe_time_range(file, reference):
+    """
+    Returns the timestamps of the first and last lines of a log by reading only its head and tail. The tail of a .gz
+    rotation cannot be reached without decompressing all of it, so its mtime is used as the last timestamp instead.
+    """
+    first = None
+    with open_log(file) as f:
+        for line in f.read(PROBE_SIZE).split(b"\n"):
+            first = line_timestamp(line, reference)
+            if first is not None:
+                break
+
+        size, mtime = log_stat(file)
+        if file.endswith(".gz"):
+            return first, mtime
+
+        f.seek(max(0, size - PROBE_SIZE))
+        for line in reversed(f.read().split(b"\n")):
+            last = line_timestamp(line, reference)
+            if last is not None:
+                return first, last
+
+    return first, None
+
+
+def classify_file(file, window):
+    # Returns "skip" if the log is entirely outside the window, "all" if entirely inside it and "filter" otherwise
+    since, until = window
+    first, last = probe_time_range(file, time_reference(file))
+    if first is None or last is None:
+        return "filter"
+
+    if (until is not None and first > until) or (since is not None and last < since):
+        return "skip"
+
+    if (since is None or first >= since) and (until is None or last <= until):
+        return "all"
+
+    return "filter"
+
+
+class WindowFilter:
+    """
+    Decides line by line whether a log is inside the --since/--until window. Lines without a timestamp of their own
+    (e.g. continuation lines) follow the decision made for the line before them.
+    """
+
+    def __init__(self, file, window):
+        self.since, self.until = window
+        self.reference = time_reference(file)
+        self.keep = False
+
+    def accept(self, line):
+        timestamp = line_timestamp(line, self.reference)
+        if timestamp is not None:
+            self.keep = (self.since is None or timestamp >= self.since) and (self.until is None or timestamp <= self.until)
+
+        return self.keep
+
+
+def window_filter(file, window):
+    # Returns a WindowFilter for logs that need to be filtered line by line, None for logs shipped whole, or "skip"
+    if window is None:
+        return None
+
+    if split_member(file):
+        # Seeking to the tail of an archive member means reading all of it, so members are always filtered
+        return WindowFilter(file, window)
+
+    mode = classify_file(file, window)
+    if mode == "skip":
+        print(f"{file} is outside of the time window. Skipping...")
+        return "skip"
+
+    return WindowFilter(file, window) if mode == "filter" else None
+
+
+def spool_window(file, dest_dir, window):
+    # Writes the lines of the log inside the window to the spool directory, for Filebeat to upload
+    out_path = os.path.join(dest_dir, os.path.basename(file[:-3] if file.endswith(".gz") else file))
+    line_filter = WindowFilter(file, window)
+    count = 0
+    with open_log(file) as f_in, open(out_path, 'wb') as f_out:
+        for line in f_in:
+            if line_filter.accept(line.rstrip(b"\r\n")):
+                f_out.write(line)
+                count += 1
+
+    return out_path, count
+
+
+def apply_window(all_files, spool_dir, workers, window):
+    """
+    Drops the logs entirely outside the window and spools the lines inside it for those only partly inside, using
+    a head/tail probe so that logs entirely inside or outside the window are never read in full.
+    """
+    kept = []
+    to_filter = []
+    for file in all_files:
+        mode = classify_file(file, window)
+        if mode == "skip":
+            print(f"{file} is outside of the time window. Skipping...")
+            continue
+
+        kept.append(file)
+        if mode == "filter":
+            to_filter.append(file)
+
+    if not to_filter:
+        return kept, {}
+
+    dest_dirs = []
+    for i in range(len(to_filter)):
+        dest_dir = os.path.join(spool_dir, str(i))
+        os.makedirs(dest_dir, exist_ok=True)
+        dest_dirs.append(dest_dir)
+
+    print(f"Filtering {len(to_filter)} log(s) to the time window in {spool_dir}...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(spool_window, to_filter, dest_dirs, [window] * len(to_filter))
+        return kept, dict(zip(to_filter, results))
+
+
+def read_lines(file, offset=0, whole_lines=False):
+    """
+    Yields the start and end byte offsets and content of each line without loading the whole file. With whole_lines,
+    a last line without its newline (i.e. still being written) is left for the next read.
+    """
+    with open_log(file) as f:
+        f.seek(offset)
+        for line in f:
+            if whole_lines and not line.endswith(b"\n"):
+                return
+
+            yield offset, offset + len(line), line.rstrip(b"\r\n")
+            offset += len(line)
+
+
+def parse_line(line):
+    doc = {"message": line.decode("utf-8", errors="replace")}
+    match = SYSLOG_PATTERN.match(line)
+    if match:
+        doc["message"] = match.group("message").decode("utf-8", errors="replace")
+        doc["host"] = {"hostname": match.group("hostname").decode("utf-8", errors="replace")}
+        doc["process"] = {"name": match.group("program").decode("utf-8", errors="replace")}
+        if match.group("pid"):
+            doc["process"]["pid"] = int(match.group("pid"))
+
+        doc["system"] = {"syslog": {"timestamp": match.group("timestamp").decode()}}
+
+    return doc
+
+
+def audit_value(record_type, key, value):
+    # Unquotes a field of an audit record, decoding the values auditd wrote in hex
+    if value[:1] in ('"', "'"):
+        return value[1:-1]
+
+    if (key in AUDIT_ENCODED_FIELDS or (record_type == "EXECVE" and AUDIT_ARG_PATTERN.match(key))) and AUDIT_HEX_PATTERN.match(value):
+        # proctitle separates the arguments of the command with NUL bytes
+        return bytes.fromhex(value).replace(b"\0", b" ").decode("utf-8", errors="replace")
+
+    return value
+
+
+def parse_audit_record(line):
+    # Returns the fields of an audit record, including those nested in the msg='...' of user space records
+    fields = {}
+    record_type = ""
+    for key, value in AUDIT_FIELD_PATTERN.findall(line):
+        if key == "type":
+            record_type = value
+
+        elif key == "msg":
+            if value[:1] == "'":
+                for nested_key, nested_value in AUDIT_FIELD_PATTERN.findall(value[1:-1]):
+                    fields.setdefault(nested_key, audit_value(record_type, nested_key, nested_value))
+            continue
+
+        fields.setdefault(key, audit_value(record_type, key, value))
+
+    return fields
+
+
+def parse_audit(event):
+    """
+    Parses an audit event: the records auditd wrote for one msg=audit(time:serial), joined by newlines. Each record
+    is kept with its own fields under auditd.log.records, and the host and process of the event are lifted out. The
+    event is decoded once and each record is split into its fields with a single regex pass.
+    """
+    doc = {"message": event.decode("utf-8", errors="replace")}
+    match = AUDIT_EVENT_PATTERN.search(event)
+    if not match:
+        return doc
+
+    records = [parse_audit_record(line) for line in doc["message"].split("\n")]
+    doc["@timestamp"] = datetime.datetime.fromtimestamp(float(match.group(2)), datetime.timezone.utc).isoformat(timespec="milliseconds")
+    doc["auditd"] = {"log": {"sequence": int(match.group(3)), "record_type": records[0].get("type"), "records": records}}
+    for fields in records:
+        if "node" in fields:
+            doc["host"] = {"hostname": fields["node"]}
+            break
+
+    for fields in records:
+        if fields.get("pid", "").isdigit():
+            doc["process"] = {"pid": int(fields["pid"])}
+            if "comm" in fields:
+                doc["process"]["name"] = fields["comm"]
+            if "exe" in fields:
+                doc["process"]["executable"] = fields["exe"]
+            break
+
+    return doc
+
+
+def audit_event_key(line):
+    match = AUDIT_EVENT_PATTERN.search(line)
+    return match.group(1) if match else None
+
+
+def group_audit_records(lines):
+    # Joins the consecutive records of each audit event (those sharing a msg=audit(time:serial)) into one. Records of
+    # an event interleaved with those of another are not joined, as upload progress needs each document to cover a
+    # contiguous byte range of the log
+    group = None
+    for start, end, line in lines:
+        key = audit_event_key(line)
+        if group and key is not None and key == group[3]:
+            group[1] = end
+            group[2].append(line)
+            continue
+
+        if group:
+            yield group[0], group[1], b"\n".join(group[2])
+        group = [start, end, [line], key]
+
+    if group:
+        yield group[0], group[1], b"\n".join(group[2])
+
+
+def last_event_start(data):
+    # Returns the offset in data (whole lines) where its last audit event starts, or its length if that is a lone line
+    end = len(data) - 1 if data.endswith(b"\n") else len(data)
+    start = data.rfind(b"\n", 0, end) + 1
+    key = audit_event_key(data[start:end])
+    if key is None:
+        return len(data)
+
+    while start > 0:
+        previous = data.rfind(b"\n", 0, start - 1) + 1
+        if audit_event_key(data[previous:start - 1]) != key:
+            break
+        start = previous
+
+    return start
+
+
+PARSERS = {"syslog": parse_line, "auditd": parse_audit}
+RECORD_GROUPERS = {"auditd": group_audit_records}  # Parsers whose documents span several lines of the log
+
+
+def read_records(log_type, file, offset=0, whole_lines=False):
+    # Yields the start and end byte offsets and content of each document of the log: a line, or an audit event
+    lines = read_lines(file, offset, whole_lines)
+    grouper = RECORD_GROUPERS.get(log_type.parser)
+    return grouper(lines) if grouper else lines
+
+
+def build_doc(abs_path, log_type, file, offset, line):
+    doc = PARSERS[log_type.parser](line)
+    if "@timestamp" not in doc:
+        timestamp = line_timestamp(line, file_time_reference(file))
+        if timestamp is not None:
+            doc["@timestamp"] = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat(timespec="milliseconds")
+    doc["log"] = {"file": {"path": file}, "offset": offset}
+    doc["event"] = {"module": log_type.module, "dataset": f"{log_type.module}.{log_type.filetype}"}
+    doc["agent"] = {"type": "linux-log-parser"}
+    doc["tags"] = [triage_name(abs_path)]
+    return doc
+
+
+def collect_logs(abs_path, profile, index=None):
+    # Returns the log files found for each log type of the OS profile
+    log_sets = []
+    for log_type in profile.log_types:
+        all_files = grab_logs(abs_path, log_type, index)
+        print("Path list of log files found:")
+        pprint.pp(all_files)
+        log_sets.append((log_type, all_files))
+
+    return log_sets
+
+
+def generate_actions(abs_path, log_sets, manifest=None, window=None, seen=None, whole_lines=False):
+    """
+    Streams a (file, start, end, document) action per log line for every file found by collect_logs(). Files already
+    partly uploaded according to the manifest are resumed from the saved offset, after sending again the ranges that
+    failed to upload, and lines outside the time window or seen before in the triage output are dropped. A dropped
+    line's bytes are covered by the next action of its file (or recorded on their own at the end of the range), so
+    the saved offset still moves past it.
+    """
+    if manifest:
+        adopt_rotations(manifest, [file for log_type, file in ordered_logs(log_sets)])
+
+    for log_type, file in ordered_logs(log_sets):
+        line_filter = window_filter(file, window)
+        if line_filter == "skip":
+            continue
+
+        offset, lines = manifest.resume_point(file) if manifest else (0, 0)
+        failed = manifest.failed_ranges(file) if manifest and offset else []
+        if manifest:
+            manifest.begin(file, offset, lines)
+        if lines:
+            print(f"Resuming {file} after {lines} lines already uploaded")
+        if failed:
+            print(f"Sending {len(failed)} ranges of {file} that failed to upload again")
+
+        for range_start, range_end in failed + [(offset, sys.maxsize)]:
+            covered = end = range_start
+            for start, end, line in read_records(log_type, file, range_start, whole_lines):
+                if start >= range_end:
+                    end = range_end
+                    break
+
+                if line_filter is None or line_filter.accept(line):
+                    if seen is None or not seen.is_duplicate(line):
+                        yield file, covered, end, build_doc(abs_path, log_type, file, start, line)
+                        covered = end
+
+            if manifest and covered < end:
+                manifest.mark_shipped(file, covered, end, 0)
+
+        if manifest:
+            manifest.mark_read(file, end)
+
+
+def chunk_actions(actions, batch_size):
+    batch = []
+    for action in actions:
+        batch.append(action)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+class IngestController:
+    """
+    Chooses the batch size and the number of bulk requests in flight from how the cluster copes with them. With
+    adaptive set, it grows both while bulk requests are fast and free of rejections, shrinks the batches when requests
+    take longer than ADAPTIVE_TARGET_LATENCY, and halves both as soon as the cluster rejects documents (additive
+    increase, multiplicative decrease). Otherwise the settings stay fixed and only the requests are recorded.
+    """
+
+    def __init__(self, batch_size, max_inflight, adaptive=False):
+        self.condition = threading.Condition()
+        self.adaptive = adaptive
+        self.batch_size = batch_size
+        # Backing off never grows a batch that already starts below the usual smallest size
+        self.min_batch_size = min(batch_size, ADAPTIVE_MIN_BATCH_SIZE)
+        self.inflight = max_inflight
+        self.max_inflight = max_inflight
+        self.active = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        self.stats = {"requests": 0, "retries": 0, "documents": 0, "rejected": 0, "seconds": 0.0,
+                      "min_batch_size": batch_size, "max_batch_size": batch_size,
+                      "min_inflight": max_inflight, "max_inflight": max_inflight}
+
+    @contextlib.contextmanager
+    def slot(self):
+        # Blocks while as many bulk requests as currently allowed are in flight
+        with self.condition:
+            while self.active >= self.inflight:
+                self.condition.wait()
+            self.active += 1
+
+        try:
+            yield
+
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+    def observe(self, documents, seconds, rejected, retry=False):
+        with self.condition:
+            self.stats["requests"] += 1
+            self.stats["retries"] += retry
+            self.stats["documents"] += documents
+            self.stats["rejected"] += rejected
+            self.stats["seconds"] += seconds
+            if not self.adaptive:
+                return
+
+            now = perf_counter()
+            if rejected:
+                # Requests already in flight were sized before the rejection, so back off once per round trip
+                if now - self.last_decrease > seconds:
+                    self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+                    self.inflight = max(1, self.inflight // 2)
+                    self.last_decrease = now
+                self.successes = 0
+
+            elif seconds > ADAPTIVE_TARGET_LATENCY:
+                if now - self.last_decrease > seconds:
+                    self.batch_size = max(self.min_batch_size, self.batch_size * 3 // 4)
+                    self.last_decrease = now
+                self.successes = 0
+
+            elif not retry:
+                self.successes += 1
+                if seconds < ADAPTIVE_TARGET_LATENCY / 2:
+                    self.batch_size = min(ADAPTIVE_MAX_BATCH_SIZE, self.batch_size + max(ADAPTIVE_MIN_BATCH_SIZE, self.batch_size // 10))
+                if self.successes >= self.inflight and self.inflight < self.max_inflight:
+                    self.inflight += 1
+                    self.successes = 0
+                    self.condition.notify_all()
+
+            self.stats["min_batch_size"] = min(self.stats["min_batch_size"], self.batch_size)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], self.batch_size)
+            self.stats["min_inflight"] = min(self.stats["min_inflight"], self.inflight)
+            self.stats["max_inflight"] = max(self.stats["max_inflight"], self.inflight)
+
+    def batches(self, actions):
+        # Like chunk_actions(), with each batch as large as the controller currently allows
+        batch = []
+        for action in actions:
+            batch.append(action)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def as_dict(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats["batch_size"] = self.batch_size
+            stats["inflight"] = self.inflight
+            stats["rejection_rate"] = stats["rejected"] / stats["documents"] if stats["documents"] else 0.0
+            stats["mean_latency"] = stats.pop("seconds") / stats["requests"] if stats["requests"] else 0.0
+            return stats
+
+
+def is_rejection(status, error):
+    # Whether Elasticsearch turned the request down because it is overloaded, so it is worth sending again later
+    return status == 429 or (isinstance(error, dict) and error.get("type") == "es_rejected_execution_exception")
+
+
+def doc_id(source):
+    """
+    Derived from the whole document, including its log and offset, so sending it again overwrites it instead of
+    adding a copy. A different line found at the same offset later (the log was rotated, truncated or collected
+    again) gets an ID of its own rather than replacing the document already indexed.
+    """
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+def bulk_request(es, index_name, docs):
+    # Returns "ok", "rejected" or "failed" for each document of a bulk request
+    body = []
+    for doc in docs:
+        source = json.dumps(doc)
+        body.append('{"index":{"_id":"%s"}}' % doc_id(source))
+        body.append(source)
+    body = "\n".join(body) + "\n"
+
+    try:
+        response = es.bulk(body=body, index=index_name)
+
+    except Exception as e:
+        status = getattr(e, "status_code", None) or getattr(e, "status", None)
+        if is_rejection(status, None):
+            return ["rejected"] * len(docs)
+
+        print(f"Bulk request failed: {e}")
+        return ["failed"] * len(docs)
+
+    if not response.get('errors'):
+        return ["ok"] * len(docs)
+
+    statuses = []
+    for item in response['items']:
+        result = item.get('index', {})
+        if result.get('status', 500) < 300:
+            statuses.append("ok")
+
+        elif is_rejection(result.get('status'), result.get('error')):
+            statuses.append("rejected")
+
+        else:
+            if "failed" not in statuses:
+                print("ERROR:" + str(result.get('error')))
+            statuses.append("failed")
+
+    return statuses
+
+
+def send_batch(es, index_name, batch, controller=None):
+    """
+    Returns whether each document of the batch was indexed. Documents rejected because the cluster is overloaded are
+    sent again on their own, after a backoff with full jitter so that parallel senders do not retry in lockstep.
+    """
+    results = [False] * len(batch)
+    todo = list(range(len(batch)))
+    for attempt in range(BULK_RETRIES + 1):
+        if attempt:
+            time.sleep(random.uniform(0, min(BULK_BACKOFF_MAX, BULK_BACKOFF * 2 ** attempt)))
+
+        with controller.slot() if controller else contextlib.nullcontext():
+            start_time = perf_counter()
+            statuses = bulk_request(es, index_name, [batch[i][3] for i in todo])
+            if controller:
+                controller.observe(len(todo), perf_counter() - start_time, statuses.count("rejected"), attempt > 0)
+
+        rejected = []
+        for i, status in zip(todo, statuses):
+            if status == "ok":
+                results[i] = True
+
+            elif status == "rejected":
+                rejected.append(i)
+
+        if not rejected:
+            break
+
+        todo = rejected
+
+    else:
+        print(f"{len(todo)} documents were still rejected after {BULK_RETRIES} retries")
+
+    return results
+
+
+def record_batch(manifest, batch, results):
+    # Marks the lines of each file as uploaded, or their byte ranges as failed so a later run only sends those again
+    runs = []
+    for (file, start, end, doc), ok in zip(batch, results):
+        if runs and runs[-1][0] == file and runs[-1][2] == start and runs[-1][3] == ok:
+            runs[-1][2] = end
+            runs[-1][4] += 1
+
+        else:
+            runs.append([file, start, end, ok, 1])
+
+    for file, start, end, ok, lines in runs:
+        if ok:
+            manifest.mark_shipped(file, start, end, lines)
+
+        else:
+            manifest.mark_failed(file, start, end)
+
+
+def new_ingest_stats():
+    return {"expected": 0, "indexed": 0, "failed": 0, "bytes": 0, "batches": 0, "files": {}}
+
+
+def record_results(stats, manifest, batch, results, save=True):
+    stats["expected"] += len(batch)
+    stats["indexed"] += results.count(True)
+    stats["failed"] += results.count(False)
+    for (file, start, end, doc), ok in zip(batch, results):
+        stats["bytes"] += end - start
+        file_stats = stats["files"].setdefault(file, {"expected": 0, "indexed": 0, "failed": 0})
+        file_stats["expected"] += 1
+        file_stats["indexed" if ok else "failed"] += 1
+
+    # Checkpoint every batch, so an interrupted upload resumes right where it stopped
+    stats["batches"] += 1
+    if manifest:
+        record_batch(manifest, batch, results)
+        if save:
+            manifest.save()
+
+
+def bulk_ingest(es, index_name, actions, batch_size, max_inflight, manifest=None, controller=None):
+    """
+    Ships documents through the _bulk API with at most max_inflight requests in progress. Batches are only built
+    as fast as they are sent, so memory stays bounded by batch_size * max_inflight regardless of the triage size.
+    A controller may size the batches and allow fewer requests in flight while the cluster is struggling.
+    """
+    stats = new_ingest_stats()
+    controller = controller or IngestController(batch_size, max_inflight)
+
+    def collect(futures):
+        for future in futures:
+            batch = pending.pop(future)
+            record_results(stats, manifest, batch, future.result())
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        for batch in controller.batches(actions):
+            if len(pending) >= max_inflight:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+
+            pending[executor.submit(send_batch, es, index_name, batch, controller)] = batch
+
+        collect(wait(pending).done)
+
+    if manifest:
+        manifest.save()
+
+    stats["ingest"] = controller.as_dict()
+    return stats
+
+
+def read_block(f):
+    # Reads about CHUNK_SIZE bytes, extended to the end of the last line so no line is split between blocks
+    data = f.read(CHUNK_SIZE)
+    if data and not data.endswith(b"\n"):
+        data += f.readline()
+
+    return data
+
+
+class BlockReader:
+    """
+    Reads a log in blocks of about CHUNK_SIZE bytes that end on a line boundary. For logs whose documents span several
+    lines (audit events), blocks end before the last event instead and it is carried over to the next block, so an
+    event is never split between two blocks.
+    """
+
+    def __init__(self, f, grouped=False):
+        self.f = f
+        self.grouped = grouped
+        self.carry = b""
+
+    def read(self):
+        data = self.carry + read_block(self.f)
+        self.carry = b""
+        if not self.grouped:
+            return data
+
+        cut = last_event_start(data)
+        while not cut:
+            more = read_block(self.f)
+            if not more:
+                return data
+
+            data += more
+            cut = last_event_start(data)
+
+        self.carry = data[cut:]
+        return data[:cut]
+
+
+async def read_log_file(abs_path, log_type, file, block_queue, manifest, window):
+    line_filter = await asyncio.to_thread(window_filter, file, window)
+    if line_filter == "skip":
+        return
+
+    offset, lines = manifest.resume_point(file) if manifest else (0, 0)
+    failed = manifest.failed_ranges(file) if manifest and offset else []
+    if manifest:
+        manifest.begin(file, offset, lines)
+    if lines:
+        print(f"Resuming {file} after {lines} lines already uploaded")
+    if failed:
+        print(f"Sending {len(failed)} ranges of {file} that failed to upload again")
+
+    f = await asyncio.to_thread(open_log, file)
+    try:
+        for range_start, range_end in failed + [(offset, sys.maxsize)]:
+            await asyncio.to_thread(f.seek, range_start)
+            reader = BlockReader(f, log_type.parser in RECORD_GROUPERS)
+            offset = range_start
+            while offset < range_end:
+                # Ranges start and end on document boundaries, so cutting a block at the end of one splits nothing
+                data = (await asyncio.to_thread(reader.read))[:range_end - offset]
+                if not data:
+                    break
+
+                await block_queue.put((abs_path, log_type, file, offset, data, line_filter))
+                offset += len(data)
+
+        if manifest:
+            manifest.mark_read(file, offset)
+
+    finally:
+        f.close()
+
+
+async def async_readers(abs_path, log_sets, block_queue, readers, manifest, window):
+    # Reads up to `readers` files at a time; each reader blocks while the parsing stage is behind
+    if manifest:
+        await asyncio.to_thread(adopt_rotations, manifest, [file for log_type, file in ordered_logs(log_sets)])
+
+    files = asyncio.Queue()
+    for log_type, file in ordered_logs(log_sets):
+        files.put_nowait((log_type, file))
+        if split_member(file):
+            # Members of a compressed tar read side by side would each restart decompression from the front
+            readers = 1
+
+    async def reader():
+        while not files.empty():
+            log_type, file = files.get_nowait()
+            await read_log_file(abs_path, log_type, file, block_queue, manifest, window)
+
+    await asyncio.gather(*[reader() for i in range(readers)])
+    await block_queue.put(None)
+
+
+async def async_parser(block_queue, action_queue, manifest, seen):
+    ends = {}  # End of the last block and action of each file, so dropped lines are covered by the next action
+    while True:
+        item = await block_queue.get()
+        if item is None:
+            await action_queue.put(None)
+            return
+
+        abs_path, log_type, file, offset, data, line_filter = item
+        block_end = offset + len(data)
+        lines = data.split(b"\n")
+        if not lines[-1]:
+            lines.pop()
+
+        # A block that does not follow the last one (a failed range sent again) starts its own coverage
+        last_end, covered = ends.get(file, (offset, offset))
+        if last_end != offset:
+            covered = offset
+
+        records = []
+        for line in lines:
+            start = offset
+            offset = min(offset + len(line) + 1, block_end)
+            records.append((start, offset, line.rstrip(b"\r")))
+        if log_type.parser in RECORD_GROUPERS:
+            records = RECORD_GROUPERS[log_type.parser](records)
+
+        actions = []
+        for start, end, record in records:
+            if line_filter is None or line_filter.accept(record):
+                if seen is None or not seen.is_duplicate(record):
+                    actions.append((file, covered, end, build_doc(abs_path, log_type, file, start, record)))
+                    covered = end
+
+        if manifest and covered < block_end:
+            manifest.mark_shipped(file, covered, block_end, 0)
+            covered = block_end
+        ends[file] = (block_end, covered)
+
+        await action_queue.put(actions)
+
+
+async def async_batcher(action_queue, batch_queue, controller, senders):
+    batch = []
+    while True:
+        actions = await action_queue.get()
+        if actions is None:
+            break
+
+        for action in actions:
+            batch.append(action)
+            if len(batch) >= controller.batch_size:
+                await batch_queue.put(batch)
+                batch = []
+
+    if batch:
+        await batch_queue.put(batch)
+
+    for i in range(senders):
+        await batch_queue.put(None)
+
+
+async def async_sender(es, index_name, batch_queue, stats, manifest, controller, checkpoint):
+    while True:
+        batch = await batch_queue.get()
+        if batch is None:
+            return
+
+        results = await asyncio.to_thread(send_batch, es, index_name, batch, controller)
+        record_results(stats, manifest, batch, results, save=False)
+        checkpoint.set()
+
+
+async def async_checkpointer(manifest, checkpoint, finished):
+    """
+    Saves the upload state whenever batches were recorded since the last save. The state is copied on the event loop
+    but fingerprinted and written in a worker thread, so a checkpoint never stalls the readers and senders; batches
+    recorded while it is written are saved by the next one. The last save is left to the end of the upload.
+    """
+    while True:
+        await checkpoint.wait()
+        checkpoint.clear()
+        if finished.is_set():
+            return
+
+        files = manifest.snapshot()
+        await asyncio.to_thread(manifest.write, files)
+        manifest.keep_fingerprints(files)
+
+
+async def run_async_ingest(es, index_name, abs_path, log_sets, batch_size, senders, readers, manifest, window, seen, controller):
+    stats = new_ingest_stats()
+    controller = controller or IngestController(batch_size, senders)
+    block_queue = asyncio.Queue(maxsize=readers * 2)
+    action_queue = asyncio.Queue(maxsize=2)
+    batch_queue = asyncio.Queue(maxsize=senders)
+    checkpoint = asyncio.Event()
+    finished = asyncio.Event()
+
+    async def pipeline():
+        await asyncio.gather(
+            async_readers(abs_path, log_sets, block_queue, readers, manifest, window),
+            async_parser(block_queue, action_queue, manifest, seen),
+            async_batcher(action_queue, batch_queue, controller, senders),
+            *[async_sender(es, index_name, batch_queue, stats, manifest, controller, checkpoint) for i in range(senders)],
+        )
+        finished.set()
+        checkpoint.set()
+
+    # Batches recorded since the last checkpoint are saved even when the upload fails
+    try:
+        await asyncio.gather(pipeline(), *([async_checkpointer(manifest, checkpoint, finished)] if manifest else []))
+
+    finally:
+        if manifest:
+            manifest.save()
+
+    stats["ingest"] = controller.as_dict()
+    return stats
+
+
+def async_ingest(es, index_name, abs_path, log_sets, batch_size, senders, readers, manifest=None, window=None, seen=None, controller=None):
+    """
+    Ships documents through an asyncio pipeline: file readers -> line parsing -> batch assembly -> `senders` concurrent
+    bulk requests. The stages are joined by bounded queues, so a slow disk and a slow cluster overlap instead of
+    waiting on each other, and memory stays bounded by the queue sizes however large the triage output is.
+    """
+    return asyncio.run(run_async_ingest(es, index_name, abs_path, log_sets, batch_size, senders, readers, manifest, window, seen, controller))
+
+
+def count_indexed_per_file(es, index_name, run_id, files):
+    """
+    Returns the number of documents indexed for each file by the Filebeat run tagged with run_id. Tagging each run
+    keeps the counts exact even when other runs or clients are writing to the same index.
+    """
+    query = {
+        "size": 0,
+        "query": {"term": {"fields.ingest_run": run_id}},
+        "aggs": {"files": {"terms": {"field": "log.file.path", "size": max(len(files), 1)}}},
+    }
+
+    try:
+        es.indices.refresh(index=index_name)
+        try:
+            response = es.search(index=index_name, body=query)
+
+        except Exception:
+            # Indices without Filebeat's template map the path as text with a keyword sub-field
+            query["aggs"]["files"]["terms"]["field"] = "log.file.path.keyword"
+            response = es.search(index=index_name, body=query)
+
+        return {bucket["key"]: bucket["doc_count"] for bucket in response["aggregations"]["files"]["buckets"]}
+
+    except Exception as e:
+        print(f"Unable to count the uploaded logs: {e}")
+        return {}
+
+
+def print_file_report(files):
+    print("Upload results per log file:")
+    for file, file_stats in files.items():
+        print(f"  {file}: expected {file_stats['expected']}, indexed {file_stats['indexed']}, failed {file_stats['failed']}")
+
+
+class LogEvent:
+    """
+    A parsed log line waiting to be written to a Parquet export. Up to EXPORT_ROW_GROUP_SIZE lines are buffered per
+    partition before being turned into columns, so each is held in slots rather than in the nested document sent to
+    Elasticsearch.
+    """
+
+    __slots__ = ("timestamp", "hostname", "program", "pid", "message", "module", "dataset", "path", "offset", "triage")
+
+    def __init__(self, doc, timestamp):
+        process = doc.get("process", {})
+        self.timestamp = timestamp
+        self.hostname = doc.get("host", {}).get("hostname")
+        self.program = process.get("name")
+        self.pid = process.get("pid")
+        self.message = doc["message"]
+        self.module = doc["event"]["module"]
+        self.dataset = doc["event"]["dataset"]
+        self.path = doc["log"]["file"]["path"]
+        self.offset = doc["log"]["offset"]
+        self.triage = doc["tags"][0]
+
+
+def parquet_schema():
+    return pyarrow.schema([
+        ("timestamp", pyarrow.timestamp("s", tz="UTC")),
+        ("hostname", pyarrow.string()),
+        ("program", pyarrow.string()),
+        ("pid", pyarrow.int64()),
+        ("message", pyarrow.string()),
+        ("module", pyarrow.string()),
+        ("dataset", pyarrow.string()),
+        ("path", pyarrow.string()),
+        ("offset", pyarrow.int64()),
+        ("triage", pyarrow.string()),
+    ])
+
+
+class NdjsonPartition:
+    # One gzipped NDJSON file of an export, holding the documents as sent to the bulk API
+    def __init__(self, path):
+        self.path = path
+        self.f = gzip.open(path + ".tmp", 'wb', compresslevel=6)
+
+    def write(self, doc, timestamp):
+        self.f.write(json.dumps(doc).encode() + b"\n")
+
+    def close(self):
+        self.f.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class ParquetPartition:
+    # One Parquet file of an export, written a row group at a time
+    def __init__(self, path):
+        self.path = path
+        self.schema = parquet_schema()
+        self.writer = pyarrow.parquet.ParquetWriter(path + ".tmp", self.schema, compression="zstd")
+        self.events = []
+
+    def write(self, doc, timestamp):
+        self.events.append(LogEvent(doc, timestamp))
+        if len(self.events) >= EXPORT_ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.events:
+            columns = [[getattr(event, name) for event in self.events] for name in LogEvent.__slots__]
+            columns[0] = [None if t is None else int(t) for t in columns[0]]
+            self.writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema))
+            self.events = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class ExportSink:
+    """
+    Writes the documents of a triage output to files partitioned by host and log type, as
+    <DIR>/host=<hostname>/dataset=<module.filetype>/<triage>.ndjson.gz (or .parquet). This is the layout Arrow, DuckDB,
+    Spark and pandas read as a single table. Files are written under a temporary name and only renamed once complete,
+    so an interrupted export never leaves a truncated file behind.
+    """
+
+    def __init__(self, export_dir, name, export_format):
+        self.export_dir = export_dir
+        self.name = name
+        self.export_format = export_format
+        self.partitions = {}
+        self.references = {}  # Year and month of each log, for the timestamps of the Parquet rows
+
+    def write(self, doc):
+        hostname = doc.get("host", {}).get("hostname") or "unknown"
+        key = (hostname, doc["event"]["dataset"])
+        partition = self.partitions.get(key)
+        if partition is None:
+            host = re.sub(r"[^\w.-]", "_", hostname)
+            folder = os.path.join(self.export_dir, f"host={host}", f"dataset={key[1]}")
+            os.makedirs(folder, exist_ok=True)
+            if self.export_format == "parquet":
+                partition = ParquetPartition(os.path.join(folder, f"{self.name}.parquet"))
+            else:
+                partition = NdjsonPartition(os.path.join(folder, f"{self.name}.ndjson.gz"))
+            self.partitions[key] = partition
+
+        timestamp = None
+        if self.export_format == "parquet":
+            path = doc["log"]["file"]["path"]
+            if path not in self.references:
+                self.references[path] = time_reference(path)
+            raw = doc["system"]["syslog"]["timestamp"] if "system" in doc else doc["message"]
+            timestamp = line_timestamp(raw.encode(), self.references[path])
+        partition.write(doc, timestamp)
+
+    def close(self):
+        for partition in self.partitions.values():
+            partition.close()
+            print(f"Exported {partition.path}")
+
+
+class SearchIndex(LogProgress):
+    """
+    Local full-text index of parsed log lines in an SQLite database, searchable by keyword (FTS5), host and time
+    without an Elasticsearch instance. Every line is stored with its host, program, log and UTC timestamp, and the
+    byte offset indexed in each log is stored alongside, with a fingerprint of its first bytes, so that a re-run only
+    adds the lines appended since (and a replaced or truncated log is indexed again). Progress is tracked by the
+    LogProgress it shares with IngestManifest, so generate_actions() and record_results() resume from it.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=SEARCH_DB_TIMEOUT, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS logs (
+                id INTEGER PRIMARY KEY, triage TEXT, host TEXT, program TEXT, dataset TEXT, path TEXT,
+                offset INTEGER, timestamp REAL, message TEXT);
+            CREATE INDEX IF NOT EXISTS logs_timestamp ON logs (timestamp);
+            CREATE INDEX IF NOT EXISTS logs_host ON logs (host, timestamp);
+            CREATE INDEX IF NOT EXISTS logs_path ON logs (path);
+            CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(message, content='logs', content_rowid='id');
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, offset INTEGER, lines INTEGER, fingerprint TEXT, fingerprint_size INTEGER);
+        """)
+        self.references = {}  # Year and month of each log, for the timestamps of syslog lines
+
+    def resume_point(self, file):
+        # Returns the byte offset and number of lines of the file already indexed
+        row = self.db.execute("SELECT offset, lines, fingerprint, fingerprint_size FROM files WHERE path = ?", (file,)).fetchone()
+        if row and row[0] and row[2] == fingerprint(file, row[3]):
+            return row[0], row[1]
+
+        return 0, 0
+
+    def begin(self, file, offset, lines):
+        if not offset:
+            # The log is new, or was replaced since it was indexed, so its old lines are dropped
+            self.db.execute("INSERT INTO logs_fts (logs_fts, rowid, message) SELECT 'delete', id, message FROM logs WHERE path = ?", (file,))
+            self.db.execute("DELETE FROM logs WHERE path = ?", (file,))
+
+        super().begin(file, offset, lines)
+
+    def adopt(self, file):
+        """
+        Moves the lines stored for a log over to a new file holding the same lines, e.g. messages renamed to
+        messages.1 by log rotation, so the rotation is not indexed again. Lines are only moved from a log that no
+        longer holds them, so a copy of a log is still indexed on its own.
+        """
+        if self.db.execute("SELECT 1 FROM files WHERE path = ?", (file,)).fetchone():
+            return False
+
+        for path, digest, size in self.db.execute("SELECT path, fingerprint, fingerprint_size FROM files WHERE fingerprint_size > 0").fetchall():
+            if digest == fingerprint(file, size) and not (log_exists(path) and digest == fingerprint(path, size)):
+                self.db.execute("UPDATE logs SET path = ? WHERE path = ?", (file, path))
+                self.db.execute("UPDATE files SET path = ? WHERE path = ?", (file, path))
+                return True
+
+        return False
+
+    def add(self, batch):
+        rows = []
+        for file, start, end, doc in batch:
+            if file not in self.references:
+                self.references[file] = time_reference(file)
+            raw = doc["system"]["syslog"]["timestamp"] if "system" in doc else doc["message"]
+            rows.append((doc["tags"][0], doc.get("host", {}).get("hostname"), doc.get("process", {}).get("name"),
+                         doc["event"]["dataset"], file, doc["log"]["offset"],
+                         line_timestamp(raw.encode(), self.references[file]), doc["message"]))
+
+        for row in rows:
+            cursor = self.db.execute("INSERT INTO logs (triage, host, program, dataset, path, offset, timestamp, message) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self.db.execute("INSERT INTO logs_fts (rowid, message) VALUES (?, ?)", (cursor.lastrowid, row[-1]))
+
+    def save(self):
+        # Commits the lines added with the offsets they move each log to, so an interrupted run resumes consistently
+        update_fingerprints(self.files)
+        for file, entry in self.files.items():
+            self.db.execute("INSERT OR REPLACE INTO files (path, offset, lines, fingerprint, fingerprint_size) VALUES (?, ?, ?, ?, ?)",
+                            (file, entry["offset"], entry["lines"], entry["fingerprint"], entry["fingerprint_size"]))
+
+        self.db.commit()
+
+    def search(self, query, window=None, hostname=None, limit=SEARCH_LIMIT):
+        # Returns the (timestamp, host, path, message) of the lines matching the query, oldest first
+        clauses = []
+        params = []
+        if query:
+            clauses.append("logs.id IN (SELECT rowid FROM logs_fts WHERE logs_fts MATCH ?)")
+            params.append(query)
+        if hostname:
+            clauses.append("logs.host = ?")
+            params.append(hostname)
+        if window and window[0] is not None:
+            clauses.append("logs.timestamp >= ?")
+            params.append(window[0])
+        if window and window[1] is not None:
+            clauses.append("logs.timestamp <= ?")
+            params.append(window[1])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self.db.execute(f"SELECT timestamp, host, path, message FROM logs {where} ORDER BY timestamp, id LIMIT ?", params + [limit]).fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+def search_logs(args):
+    # Prints the lines of the local index matching --search, --hostname and --since/--until
+    if not os.path.exists(args.index_db):
+        print(f"The following local index cannot be found: {args.index_db}")
+        sys.exit(1)
+
+    store = SearchIndex(args.index_db)
+    start_time = perf_counter()
+    try:
+        rows = store.search(args.search, parse_window(args.since, args.until), args.hostname, args.limit)
+
+    except sqlite3.OperationalError as e:
+        print(f"Invalid search query: {e}")
+        sys.exit(1)
+
+    finally:
+        store.close()
+    stop_time = perf_counter() - start_time
+
+    for timestamp, host, path, message in rows:
+        moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat() if timestamp is not None else "-"
+        print(f"{moment} {host or '-'} {path}: {message}")
+    print(f"Lines found: {len(rows)}{' (limited by --limit)' if len(rows) == args.limit else ''}")
+    print(f"Time elapsed: {stop_time * 1000:.1f}ms")
+
+
+class StageMetrics:
+    """
+    Durations, bytes and lines of each stage of a triage output's upload. Stages may be nested, in which case the time
+    spent in the inner stage is not counted towards the outer one.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.children = []
+        self.ingest = None  # Settings chosen and requests recorded by the IngestController, for the bulk API
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        self.children.append(0.0)
+        start_time = perf_counter()
+        try:
+            yield
+
+        finally:
+            elapsed = perf_counter() - start_time
+            inner = self.children.pop()
+            if self.children:
+                self.children[-1] += elapsed
+            self.add(stage, seconds=elapsed - inner)
+
+    def add(self, stage, seconds=0.0, size=0, lines=0):
+        entry = self.stages.setdefault(stage, {"seconds": 0.0, "bytes": 0, "lines": 0})
+        entry["seconds"] += seconds
+        entry["bytes"] += size
+        entry["lines"] += lines
+
+    def as_dict(self):
+        stages = {}
+        for stage, entry in self.stages.items():
+            seconds = entry["seconds"]
+            stages[stage] = dict(entry)
+            stages[stage]["lines_per_second"] = entry["lines"] / seconds if seconds else 0.0
+            stages[stage]["bytes_per_second"] = entry["bytes"] / seconds if seconds else 0.0
+
+        metrics = {"triage": self.name, "stages": stages}
+        if self.ingest:
+            metrics["ingest"] = self.ingest
+
+        return metrics
+
+
+def format_prometheus(metrics_list):
+    lines = []
+    for field, description in METRIC_FIELDS:
+        lines.append(f"# HELP linux_log_parser_stage_{field} {description}")
+        lines.append(f"# TYPE linux_log_parser_stage_{field} gauge")
+        for metrics in metrics_list:
+            triage = metrics["triage"].replace("\\", "\\\\").replace('"', '\\"')
+            for stage, entry in metrics["stages"].items():
+                lines.append(f'linux_log_parser_stage_{field}{{triage="{triage}",stage="{stage}"}} {entry[field]}')
+
+    for field in sorted({field for metrics in metrics_list for field in metrics.get("ingest", {})}):
+        lines.append(f"# TYPE linux_log_parser_ingest_{field} gauge")
+        for metrics in metrics_list:
+            if field in metrics.get("ingest", {}):
+                triage = metrics["triage"].replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'linux_log_parser_ingest_{field}{{triage="{triage}"}} {metrics["ingest"][field]}')
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(metrics_list, metrics_file, metrics_format):
+    if metrics_format == "prometheus":
+        output = format_prometheus(metrics_list)
+
+    else:
+        output = json.dumps(metrics_list, indent=2) + "\n"
+
+    if metrics_file == "-":
+        sys.stdout.write(output)
+        return
+
+    try:
+        with open(metrics_file, "w") as f:
+            f.write(output)
+        print(f"Metrics saved to {metrics_file}")
+
+    except OSError as e:
+        print(e)
+        print(f"Unable to save metrics to {metrics_file}")
+
+
+def write_profile(profiler, profile_dir, name):
+    # Saves the cProfile statistics of a triage output, both raw (for snakeviz/pstats) and as a readable summary
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(profile_dir, f"{name}.pstats"))
+    with open(os.path.join(profile_dir, f"{name}.txt"), "w") as f:
+        pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+
+
+def write_memory_profile(profile_dir):
+    os.makedirs(profile_dir, exist_ok=True)
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    with open(os.path.join(profile_dir, "tracemalloc.txt"), "w") as f:
+        f.write(f"Current memory: {current / 1024 / 1024:0.2f} MB\n")
+        f.write(f"Peak memory: {peak / 1024 / 1024:0.2f} MB\n")
+        for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+            f.write(f"{stat}\n")
+
+
 def format_time(t):
     if t >= 59 * 60:
         hours = int(t / 60 / 60)
@@ -273,17 +2701,752 @@ def format_time(t):
         return f"{t:0.2f}s"
 
 
+def unique_names(abs_path_list):
+    names = []
+    for abs_path in abs_path_list:
+        basename = triage_name(abs_path)
+        name = basename
+        suffix = 2
+        while name in names:
+            name = f"{basename}-{suffix}"
+            suffix += 1
+        names.append(name)
+
+    return names
+
+
+class TriageOutput:
+    """
+    Stands in for sys.stdout while triage outputs are processed in parallel. Each thread's output is buffered per line
+    and prefixed with the name of the triage output it is working on, so lines from different triages never interleave.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def set_name(self, name):
+        # Any unfinished line of the previous triage output is written out first
+        if getattr(self.local, "buffer", ""):
+            self.write("\n")
+        self.local.name = name
+        self.local.buffer = ""
+
+    def write(self, text):
+        name = getattr(self.local, "name", None)
+        if name is None:
+            with self.lock:
+                return self.stream.write(text)
+
+        self.local.buffer += text
+        *lines, self.local.buffer = self.local.buffer.split("\n")
+        with self.lock:
+            for line in lines:
+                self.stream.write(f"[{name}] {line}\n")
+
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+
+def run_named(name, func, *args):
+    # Runs func with every line it prints prefixed with the name of the triage output
+    sys.stdout.set_name(name)
+    try:
+        return func(*args)
+
+    finally:
+        sys.stdout.set_name(None)
+
+
+def run_triage_job(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, progress):
+    sys.stdout.set_name(name)
+    try:
+        summary = process_triage(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, args.jobs)
+
+    finally:
+        sys.stdout.set_name(None)
+
+    with sys.stdout.lock:
+        progress["done"] += 1
+        sys.stdout.stream.write(f"Progress: {progress['done']}/{progress['total']} triage outputs completed ({name})\n")
+
+    return summary
+
+
+def process_triage(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, jobs):
+    handler = export_triage if args.export else store_triage if args.index_db else upload_triage
+    if not args.profile:
+        return handler(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, jobs)
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+
+    except ValueError:
+        # Only one profiler can be active at a time on newer Python versions
+        print("Another triage output is being profiled, skipping profiling...")
+        return handler(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, jobs)
+
+    try:
+        return handler(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, jobs)
+
+    finally:
+        profiler.disable()
+        write_profile(profiler, args.profile, name)
+
+
+def open_triage(args, abs_path, name, system, filebeat_dir, metrics):
+    # Returns the OS profile, file index, upload manifest and duplicate line filter of a triage output
+    index_name = args.index[0] if args.index else None
+
+    # Retrieve the compiled profile of the specified OS
+    profile = check_system(system, filebeat_dir)
+    print(f"Loading configuration profile for {system}...")
+    for log_type in profile.log_types:
+        print(f"{log_type.module}.{log_type.filetype} ({log_type.parser} parser): {list(log_type.paths)}")
+
+    # Scan the triage output once for every stage below
+    with metrics.stage("discovery"):
+        index = index_triage(abs_path, profile.roots)
+    print(f"Files indexed in {name}: {len(index)}")
+
+    # A time-windowed run only uploads part of each log, and exports and local indexes upload nothing, so none of them
+    # resume from or update the manifest
+    manifest = None if args.window or args.export or args.index_db else IngestManifest(index_name, name)
+    if manifest and args.reset:
+        manifest.reset()
+
+    # Lines already uploaded to the index count as seen, so their copies in other logs are dropped too
+    seen = None
+    if args.dedup:
+        seen = SeenLines()
+        if manifest:
+            with metrics.stage("dedup"):
+                prime_seen_lines(seen, manifest)
+            seen.duplicates = 0
+
+    return profile, index, manifest, seen
+
+
+def filebeat_cmd(filebeat_dir, urls, index_name, fb_state_dir, run_id, batch_size, max_inflight):
+    """
+    Every document of a Filebeat run is tagged with the run's ID so it can be counted per file afterwards. Filebeat's
+    bulk size and number of output workers follow --batch-size and --max-inflight, and it retries the documents the
+    cluster rejects with its own backoff (it does not adapt them as --adaptive does for the native engine). With
+    several URLs, Filebeat spreads its bulk requests over them and fails over from a node that stops responding.
+    """
+    return [
+        filebeat_dir + '/filebeat',
+        '-e',
+        '-c', filebeat_dir + '/filebeat.yml',
+        '-E', 'output.elasticsearch.hosts=' + json.dumps(urls),
+        '-E', 'output.elasticsearch.index=\'' + index_name + '\'',
+        '-E', 'setup.template.name=\'' + index_name + '\'',
+        '-E', 'setup.template.pattern=\'' + index_name + '\'',
+        '-E', 'setup.ilm.enabled=false',
+        '-E', 'filebeat.registry.path=\'' + fb_state_dir + '\'',
+        '-E', 'filebeat.shutdown_timeout=' + FILEBEAT_SHUTDOWN_TIMEOUT,
+        '-E', 'output.elasticsearch.bulk_max_size=' + str(batch_size),
+        '-E', 'output.elasticsearch.worker=' + str(max_inflight),
+        '-E', 'output.elasticsearch.backoff.init=' + str(BULK_BACKOFF) + 's',
+        '-E', 'output.elasticsearch.backoff.max=' + str(BULK_BACKOFF_MAX) + 's',
+        '-E', 'fields.ingest_run=' + run_id
+    ]
+
+
+def print_command(command):
+    # Print the built command executed
+    print_cmd = ''
+    for cmd in command:
+        print_cmd = print_cmd + " " + cmd
+    print("Command executed:")
+    print(print_cmd)
+
+
+def run_filebeat(command, fb_log_path=None):
+    try:
+        if fb_log_path:
+            # Filebeat's own output is kept in its registry folder so parallel runs stay readable
+            print(f"Filebeat output is written to {fb_log_path}")
+            with open(fb_log_path, "wb") as fb_log:
+                subprocess.Popen(command, stdout=fb_log, stderr=subprocess.STDOUT).wait()
+
+        else:
+            subprocess.Popen(command).wait()
+
+    except Exception as e:
+        print(e)
+
+
+def filebeat_stats(shipped, indexed, total_expected_doc_count, manifest, metrics):
+    # Compares the documents indexed for each log with the lines expected, and records the fully indexed logs
+    stats = {"expected": total_expected_doc_count, "indexed": 0, "failed": 0, "files": {}}
+    for file, ship_file, count, offset, lines, done in shipped:
+        file_stats = {"expected": count - lines, "indexed": indexed.get(ship_file, 0)}
+        file_stats["failed"] = file_stats["expected"] - file_stats["indexed"]
+        stats["files"][file] = file_stats
+        stats["indexed"] += file_stats["indexed"]
+        stats["failed"] += file_stats["failed"]
+        metrics.add("shipping", size=os.path.getsize(ship_file) - offset, lines=file_stats["indexed"])
+
+        # Only logs confirmed to be fully indexed are skipped on the next run
+        if manifest and file_stats["failed"] == 0:
+            manifest.begin(file, *done)
+
+    if manifest:
+        manifest.save()
+
+    return stats
+
+
+def finish_triage(es, index_name, name, system, stats, seen, metrics, stop_time, jobs):
+    print_file_report(stats["files"])
+    print("Upload completed!")
+    print(f"Total logs expected: {stats['expected']}")
+    print(f"Total logs uploaded: {stats['indexed']}")
+    print(f"Total logs failed to upload: {stats['failed']}")
+    if seen:
+        print(f"Total duplicate lines dropped: {seen.duplicates}")
+    if jobs == 1:
+        print(f"Total logs ingested in {index_name} on Elasticsearch: {es.count(index=index_name)['count']}")
+    print(f"Time elapsed: {format_time(stop_time)}")
+
+    return {
+        "name": name,
+        "system": system,
+        "expected": stats["expected"],
+        "uploaded": stats["indexed"],
+        "failed": stats["failed"],
+        "time": stop_time,
+        "metrics": metrics.as_dict(),
+    }
+
+
+def upload_triage(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, jobs):
+    metrics = StageMetrics(name)
+    urls = args.url
+    index_name = args.index[0]
+    profile, index, manifest, seen = open_triage(args, abs_path, name, system, filebeat_dir, metrics)
+
+    if args.ingest == "filebeat":
+        run_id = uuid.uuid4().hex
+        preset_cmd = filebeat_cmd(filebeat_dir, urls, index_name, fb_state_dir, run_id, args.batch_size, args.max_inflight)
+
+        # Decompressed rotations are kept with the Filebeat data, never inside the triage output. Each run spools to
+        # its own folder, as a spooled file recreated at the same path could reuse an inode the registry has an
+        # offset for, and Filebeat would then skip its first lines. The path is absolute, as it is the log.file.path
+        # Filebeat reports for the spooled copies and is matched against to add the path of their logs
+        spool_dir = os.path.abspath(os.path.join(filebeat_dir, "data", "spool", name, run_id))
+        with metrics.stage("command_build"):
+            command, total_expected_doc_count, shipped = build_cmd(abs_path, filebeat_dir, preset_cmd, profile, spool_dir, args.workers, index, manifest, metrics, args.window, seen)
+        print_command(command)
+
+    create_index(es, index_name)
+
+    if args.ingest in ("native", "async"):
+        with metrics.stage("discovery"):
+            log_sets = collect_logs(abs_path, profile, index)
+            if args.resume:
+                log_sets = [(log_type, [file for file in all_files if manifest.unfinished(file)]) for log_type, all_files in log_sets]
+                print(f"Resuming {sum(len(all_files) for log_type, all_files in log_sets)} logs left unfinished by the last upload")
+
+            elif manifest:
+                manifest.plan(file for log_type, all_files in log_sets for file in all_files)
+                manifest.save()
+
+        print("Uploading logs from \"" + name + "\" with the bulk API...")
+        start_time = perf_counter()
+        controller = IngestController(args.batch_size, args.max_inflight, args.adaptive)
+        with metrics.stage("shipping"):
+            if args.ingest == "async":
+                stats = async_ingest(es, index_name, abs_path, log_sets, args.batch_size, args.max_inflight, args.readers, manifest, args.window, seen, controller)
+
+            else:
+                actions = generate_actions(abs_path, log_sets, manifest, args.window, seen)
+                stats = bulk_ingest(es, index_name, actions, args.batch_size, args.max_inflight, manifest, controller)
+        metrics.add("shipping", size=stats["bytes"], lines=stats["indexed"])
+        metrics.ingest = stats["ingest"]
+        if stats["ingest"]["rejected"]:
+            print(f"Documents rejected by Elasticsearch and retried: {stats['ingest']['rejected']}")
+        if args.adaptive:
+            print(f"Final batch size: {controller.batch_size}, bulk requests in flight: {controller.inflight}")
+        if manifest and manifest.failed_count():
+            print(f"Ranges of logs that failed to upload: {manifest.failed_count()} (Run again with --resume to send only those)")
+        stop_time = perf_counter() - start_time
+
+        with metrics.stage("verification"):
+            es.indices.refresh(index=index_name)
+
+    else:
+        # Parse the logs to filebeat
+        print("Uploading logs from \"" + name + "\" to filebeat...")
+        start_time = perf_counter()
+        with metrics.stage("shipping"):
+            run_filebeat(command, os.path.join(filebeat_dir, "data", fb_state_dir, "filebeat.log") if jobs > 1 else None)
+        stop_time = perf_counter() - start_time
+
+        # Filebeat only exits once its events are acknowledged, so the run's documents can be counted right away
+        with metrics.stage("verification"):
+            indexed = count_indexed_per_file(es, index_name, run_id, [ship_file for file, ship_file, count, offset, lines, done in shipped])
+
+        stats = filebeat_stats(shipped, indexed, total_expected_doc_count, manifest, metrics)
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    return finish_triage(es, index_name, name, system, stats, seen, metrics, stop_time, jobs)
+
+
+def export_triage(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, jobs):
+    metrics = StageMetrics(name)
+    profile, index, manifest, seen = open_triage(args, abs_path, name, system, filebeat_dir, metrics)
+
+    with metrics.stage("discovery"):
+        log_sets = collect_logs(abs_path, profile, index)
+
+    print(f"Exporting logs from \"{name}\" to {args.export} as {args.export_format}...")
+    start_time = perf_counter()
+    stats = new_ingest_stats()
+    sink = ExportSink(args.export, name, args.export_format)
+    with metrics.stage("export"):
+        for batch in chunk_actions(generate_actions(abs_path, log_sets, None, args.window, seen), args.batch_size):
+            for file, start, end, doc in batch:
+                sink.write(doc)
+            record_results(stats, None, batch, [True] * len(batch))
+        sink.close()
+    metrics.add("export", size=stats["bytes"], lines=stats["indexed"])
+    stop_time = perf_counter() - start_time
+
+    print_file_report(stats["files"])
+    print("Export completed!")
+    print(f"Total logs exported: {stats['indexed']}")
+    if seen:
+        print(f"Total duplicate lines dropped: {seen.duplicates}")
+    print(f"Time elapsed: {format_time(stop_time)}")
+
+    return {
+        "name": name,
+        "system": system,
+        "expected": stats["expected"],
+        "uploaded": stats["indexed"],
+        "failed": 0,
+        "time": stop_time,
+        "metrics": metrics.as_dict(),
+    }
+
+
+def store_triage(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, jobs):
+    metrics = StageMetrics(name)
+    profile, index, manifest, seen = open_triage(args, abs_path, name, system, filebeat_dir, metrics)
+
+    with metrics.stage("discovery"):
+        log_sets = collect_logs(abs_path, profile, index)
+
+    print(f"Indexing logs from \"{name}\" in {args.index_db}...")
+    start_time = perf_counter()
+    stats = new_ingest_stats()
+    store = SearchIndex(args.index_db)
+    try:
+        with metrics.stage("indexing"):
+            for batch in chunk_actions(generate_actions(abs_path, log_sets, store, None, seen), args.batch_size):
+                store.add(batch)
+                record_results(stats, store, batch, [True] * len(batch), save=False)
+                store.save()
+            store.save()
+
+    finally:
+        store.close()
+    metrics.add("indexing", size=stats["bytes"], lines=stats["indexed"])
+    stop_time = perf_counter() - start_time
+
+    print_file_report(stats["files"])
+    print("Indexing completed!")
+    print(f"Total logs indexed: {stats['indexed']}")
+    if seen:
+        print(f"Total duplicate lines dropped: {seen.duplicates}")
+    print(f"Time elapsed: {format_time(stop_time)}")
+
+    return {
+        "name": name,
+        "system": system,
+        "expected": stats["expected"],
+        "uploaded": stats["indexed"],
+        "failed": 0,
+        "time": stop_time,
+        "metrics": metrics.as_dict(),
+    }
+
+
+def fileset_names(filebeat_dir, module):
+    # Returns the filesets Filebeat ships for the module, e.g. syslog and auth for system
+    module_path = os.path.join(filebeat_dir, "module", module)
+    try:
+        return sorted(fileset for fileset in os.listdir(module_path) if os.path.isdir(os.path.join(module_path, fileset)))
+
+    except OSError:
+        return []
+
+
+def batch_modules(filebeat_dir, batch):
+    """
+    Builds the filebeat.modules configuration reading the logs of every triage output in the batch. Each triage output
+    gets its own module entries, whose events are tagged with its name, and filesets that are not read are disabled
+    so Filebeat never falls back to their default paths on this host.
+    """
+    modules = []
+    for triage in batch:
+        for module in dict.fromkeys(module for module, filetype, ship_files, sources in triage["inputs"]):
+            entry = {"module": module}
+            for fileset in fileset_names(filebeat_dir, module):
+                entry[fileset] = {"enabled": False}
+
+            for input_module, filetype, ship_files, sources in triage["inputs"]:
+                if input_module == module and ship_files:
+                    entry[filetype] = {
+                        "enabled": True,
+                        "var.paths": ship_files,
+                        "input": {"fields": {"triage": triage["name"]}, "tags": [triage["name"]], "processors": source_fields(sources)},
+                    }
+            modules.append(entry)
+
+    return {"filebeat.modules": modules}
+
+
+def prepare_batch_triage(args, abs_path, name, system, filebeat_dir, run_id):
+    metrics = StageMetrics(name)
+    profile, index, manifest, seen = open_triage(args, abs_path, name, system, filebeat_dir, metrics)
+    spool_dir = os.path.abspath(os.path.join(filebeat_dir, "data", "spool", name, run_id))
+    with metrics.stage("command_build"):
+        inputs, total_expected_doc_count, shipped = collect_filebeat_logs(abs_path, filebeat_dir, profile, spool_dir, args.workers, index, manifest, metrics, args.window, seen)
+
+    return {"name": name, "system": system, "metrics": metrics, "manifest": manifest, "seen": seen, "spool_dir": spool_dir,
+            "inputs": inputs, "expected": total_expected_doc_count, "shipped": shipped}
+
+
+def upload_batch(args, es, triage_list, filebeat_dir, jobs):
+    """
+    Uploads every triage output with a single Filebeat process instead of one per triage output, so Filebeat's startup
+    (modules, ingest pipelines and templates) is paid once and its harvesters read the logs of all of them in parallel.
+    The logs are listed in a generated filebeat.modules configuration passed with an extra -c, and share one registry.
+    """
+    urls = args.url
+    index_name = args.index[0]
+    fb_state_dir = check_registry_folder(filebeat_dir, f"{index_name}-batch", args.reset)
+    run_id = uuid.uuid4().hex
+
+    if jobs == 1:
+        batch = [prepare_batch_triage(args, abs_path, name, system, filebeat_dir, run_id) for abs_path, name, system in triage_list]
+
+    else:
+        sys.stdout = TriageOutput(sys.stdout)
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(run_named, name, prepare_batch_triage, args, abs_path, name, system, filebeat_dir, run_id)
+                           for abs_path, name, system in triage_list]
+                batch = [future.result() for future in futures]
+
+        finally:
+            sys.stdout = sys.stdout.stream
+
+    modules_path = os.path.abspath(os.path.join(filebeat_dir, "data", fb_state_dir, "modules.yml"))
+    with open(modules_path, "w") as f:
+        yaml.safe_dump(batch_modules(filebeat_dir, batch), f, default_flow_style=False, sort_keys=False)
+
+    command = filebeat_cmd(filebeat_dir, urls, index_name, fb_state_dir, run_id, args.batch_size, args.max_inflight)
+    command += ['-c', modules_path, "--once"]
+    print_command(command)
+
+    create_index(es, index_name)
+
+    print(f"Uploading logs from {len(batch)} triage outputs to filebeat...")
+    start_time = perf_counter()
+    run_filebeat(command)
+    shipping_time = perf_counter() - start_time
+
+    # One query counts the documents of every triage output, since they were all tagged with the same run ID
+    start_time = perf_counter()
+    indexed = count_indexed_per_file(es, index_name, run_id, [ship_file for triage in batch for file, ship_file, count, offset, lines, done in triage["shipped"]])
+    verification_time = perf_counter() - start_time
+
+    summaries = []
+    for triage in batch:
+        print(f"Results for \"{triage['name']}\":")
+        metrics = triage["metrics"]
+        metrics.add("shipping", seconds=shipping_time)
+        metrics.add("verification", seconds=verification_time)
+        stats = filebeat_stats(triage["shipped"], indexed, triage["expected"], triage["manifest"], metrics)
+        shutil.rmtree(triage["spool_dir"], ignore_errors=True)
+        summaries.append(finish_triage(es, index_name, triage["name"], triage["system"], stats, triage["seen"], metrics, shipping_time, len(batch)))
+
+    return summaries
+
+
+class Inotify:
+    # Minimal inotify binding through libc, so following logs needs no extra package
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, folder):
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), folder)
+        return wd
+
+    def read(self, timeout):
+        # Returns the (watch descriptor, mask, name) of the events received within timeout seconds
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = struct.unpack_from("iIII", data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+                events.append((wd, mask, os.fsdecode(name)))
+                offset += 16 + length
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LogWatcher:
+    """
+    Waits for lines appended to the logs in a set of folders and for new logs there (e.g. fresh rotations). It uses
+    inotify where available and otherwise polls the folders every interval seconds, comparing the size and mtime of
+    their files. Only these folders are ever looked at, never the rest of the triage output.
+    """
+
+    def __init__(self, folders, interval):
+        self.folders = folders
+        self.interval = interval
+        self.inotify = None
+        self.snapshot = self.scan()
+        try:
+            self.inotify = Inotify()
+            self.watches = {self.inotify.add_watch(folder): folder for folder in folders}
+
+        except (OSError, AttributeError) as e:
+            print(f"Unable to use inotify ({e}), polling every {interval}s instead")
+            if self.inotify:
+                self.inotify.close()
+            self.inotify = None
+
+    def scan(self):
+        files = {}
+        for folder in self.folders:
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+
+            except OSError:
+                pass
+
+        return files
+
+    def poll(self):
+        snapshot = self.scan()
+        changed = {path for path, key in snapshot.items() if self.snapshot.get(path) != key}
+        self.snapshot = snapshot
+        return changed
+
+    def changes(self):
+        # Blocks until files in the folders change, and returns their paths (an empty set if nothing changed in time)
+        if self.inotify is None:
+            time.sleep(self.interval)
+            return self.poll()
+
+        events = self.inotify.read(self.interval)
+        if not events:
+            return set()
+
+        # Lines are often written in bursts, so the events of the burst are gathered before shipping
+        time.sleep(FOLLOW_SETTLE_TIME)
+        events += self.inotify.read(0)
+        if any(mask & Inotify.IN_Q_OVERFLOW for wd, mask, name in events):
+            return self.poll()
+
+        return {os.path.join(self.watches[wd], name) for wd, mask, name in events if name and wd in self.watches}
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+
+
+def gzip_complete(file):
+    # Whether a .gz log can be read to its end, i.e. it is not still being written by logrotate
+    try:
+        with open_log(file) as f:
+            while f.read(CHUNK_SIZE):
+                pass
+        return True
+
+    except (OSError, EOFError):
+        return False
+
+
+def follow_triages(args, es, triage_list):
+    """
+    Keeps uploading the lines appended to the logs of the triage outputs, and the logs that appear next to them, until
+    interrupted. Each log resumes from the offset saved in its triage output's manifest, so nothing already uploaded
+    is read again; only whole lines are shipped, and a rotation renamed from a log already uploaded takes over its
+    upload state instead of being uploaded again.
+    """
+    index_name = args.index[0]
+    followed = []
+    folders = set()
+    for abs_path, name, system, fb_state_dir in triage_list:
+        profile = check_system(system)
+        manifest = IngestManifest(index_name, name)
+        seen = None
+        if args.dedup:
+            seen = SeenLines()
+            prime_seen_lines(seen, manifest)
+
+        # The folders of the logs found by the upload, and the configured folders that exist
+        for path, (rel_path, size, mtime) in index_triage(abs_path, profile.roots).items():
+            if any(pattern.match(rel_path) for log_type in profile.log_types for pattern in log_type.patterns):
+                folders.add(os.path.dirname(path))
+        for log_type in profile.log_types:
+            for sub_path in log_type.paths:
+                static = re.split(r"[*?\[]", sub_path.strip("/"), maxsplit=1)[0]
+                path = os.path.join(abs_path, static)
+                if os.path.isdir(path):
+                    folders.add(os.path.normpath(path))
+
+        controller = IngestController(args.batch_size, args.max_inflight, args.adaptive)
+        followed.append((abs_path, name, profile, manifest, seen, controller))
+
+    watcher = LogWatcher(sorted(folders), args.poll_interval)
+    print(f"Following {len(folders)} folder(s) for new log lines, press Ctrl+C to stop...")
+    total = 0
+    try:
+        while True:
+            changed = watcher.changes()
+            for abs_path, name, profile, manifest, seen, controller in followed:
+                log_sets = []
+                for log_type in profile.log_types:
+                    files = []
+                    for file in sorted(changed):
+                        if not file.startswith(abs_path + os.sep) or not os.path.isfile(file):
+                            continue
+                        rel_path = os.path.relpath(file, abs_path).replace(os.sep, "/")
+                        if not any(pattern.match(rel_path) for pattern in log_type.patterns):
+                            continue
+
+                        if file.endswith(".gz") and not gzip_complete(file):
+                            # A rotation still being compressed is picked up by the event of its last write
+                            continue
+                        files.append(file)
+
+                    if files:
+                        log_sets.append((log_type, files))
+
+                if not log_sets:
+                    continue
+
+                actions = generate_actions(abs_path, log_sets, manifest, None, seen, whole_lines=True)
+                stats = bulk_ingest(es, index_name, actions, controller.batch_size, args.max_inflight, manifest, controller)
+                total += stats["indexed"]
+                if stats["expected"]:
+                    print(f"[{name}] Uploaded {stats['indexed']} new line(s), {stats['failed']} failed (Total since following: {total})")
+
+    except KeyboardInterrupt:
+        print("Stopped following the triage outputs")
+
+    finally:
+        watcher.close()
+        for abs_path, name, profile, manifest, seen, controller in followed:
+            manifest.save()
+
+
+def print_summary(summaries, post_doc_count, index_name, stop_time):
+    print("Summary:")
+    for summary in summaries:
+        print(f"  {summary['name']} ({summary['system']}): expected {summary['expected']}, uploaded {summary['uploaded']}, failed {summary['failed']}, time {format_time(summary['time'])}")
+
+    print(f"Total logs expected: {sum(summary['expected'] for summary in summaries)}")
+    print(f"Total logs uploaded: {sum(summary['uploaded'] for summary in summaries)}")
+    print(f"Total logs failed to upload: {sum(summary['failed'] for summary in summaries)}")
+    if post_doc_count is not None:
+        print(f"Total logs ingested in {index_name} on Elasticsearch: {post_doc_count}")
+    print(f"Time elapsed: {format_time(stop_time)}")
+
+
+def write_reports(args, summaries):
+    if args.metrics:
+        write_metrics([summary["metrics"] for summary in summaries], args.metrics, args.metrics_format)
+
+    if args.profile:
+        write_memory_profile(args.profile)
+        tracemalloc.stop()
+        print(f"Profiling reports saved to {args.profile}")
+
+
+def upload_all(args, es, triage_list, filebeat_dir, jobs):
+    # Returns the summary of every triage output, and the time taken if a combined summary should be printed
+    if args.batch:
+        start_time = perf_counter()
+        summaries = upload_batch(args, es, [(abs_path, name, system) for abs_path, name, system, fb_state_dir in triage_list], filebeat_dir, jobs)
+        return summaries, perf_counter() - start_time
+
+    if jobs == 1:
+        summaries = [process_triage(args, es, abs_path, name, system, filebeat_dir, fb_state_dir, 1)
+                     for abs_path, name, system, fb_state_dir in triage_list]
+        return summaries, None
+
+    # Run the triage outputs in parallel, prefixing every line printed with the name of the triage output
+    start_time = perf_counter()
+
+    progress = {"done": 0, "total": len(triage_list)}
+    sys.stdout = TriageOutput(sys.stdout)
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run_triage_job, args, es, abs_path, name, system, filebeat_dir, fb_state_dir, progress)
+                       for abs_path, name, system, fb_state_dir in triage_list]
+            summaries = [future.result() for future in futures]
+
+    finally:
+        sys.stdout = sys.stdout.stream
+
+    return summaries, perf_counter() - start_time
+
+
 def main():
     # Parse arguments
     args = parse_args()
-    system = args.system[0]
-    url = args.url[0]
-    index_name = args.index[0]
+    args.url = split_hosts(args.url) or None
+    index_name = args.index[0] if args.index else None
     filebeat_dir = ''
+    offline = args.export or args.index_db  # Nothing is uploaded to Elasticsearch
 
-    if args.system is None:
-        print("Please specify the operating system.")
-        sys.exit(1)
+    if args.search is not None:
+        if not args.index_db:
+            print("Please specify the local index to search with --index-db")
+            sys.exit(1)
+
+        search_logs(args)
+        return
 
     if not args.dir:
         print("Please specify the file path.")
@@ -294,7 +3457,7 @@ def main():
     for relative_path in args.dir:
         if os.path.exists(relative_path):
             abs_path = os.path.abspath(relative_path)
-            if not os.path.isdir(abs_path):
+            if not os.path.isdir(abs_path) and not is_archive(abs_path):
                 print("The following indicated path cannot be found: " + abs_path)
                 sys.exit(1)
 
@@ -308,110 +3471,107 @@ def main():
     print("Number of triage outputs to upload: " + str(path_count))
     print("Path list of triage outputs:")
     pprint.pp(str(abs_path_list))
-    exit()
-    if args.url is None:
+
+    if args.url is None and not offline:
         print("Please specify the URL for Elastic Search instance (Including port number)")
         sys.exit(1)
 
-    if args.index is None:
+    if args.index is None and not offline:
         print("Please specify the index on Elastic Search")
         sys.exit(1)
 
-    not_found = True
-    if args.path:
-        filebeat_dir = args.path
-        if os.path.isdir(filebeat_dir):
-            print("Filebeat directory set to " + args.path)
+    if args.export and args.export_format == "parquet" and pyarrow is None:
+        print("Exporting to Parquet requires pyarrow (pip install pyarrow)")
+        sys.exit(1)
 
-        else:
-            not_found = False
+    if offline and args.batch:
+        print("--batch cannot be used with --export or --index-db")
+        sys.exit(1)
 
-    else:
-        for dirs in os.listdir("."):
-            if "filebeat" and "linux" in dirs:
-                default_path = os.path.join(".", dirs)
-                if os.path.isdir(default_path):
-                    filebeat_dir = default_path
-                    not_found = False
-                    break
+    if offline and args.bulk_load:
+        print("--bulk-load cannot be used with --export or --index-db")
+        sys.exit(1)
 
-    if not_found:
-        print("Filebeat directory not found, please ensure that filebeat is downloaded in the current working directory or its specified directory path is relative to the current working directory.")
-        print("Use the '-p' option if located in another folder")
+    if args.force_merge is not None and not args.bulk_load:
+        print("--force-merge can only be used with --bulk-load")
+        sys.exit(1)
+
+    if args.export and args.index_db:
+        print("--export and --index-db cannot be used together")
+        sys.exit(1)
+
+    # A local index is only ever extended, so a time-windowed run would leave gaps that later runs never fill
+    if args.index_db and (args.since or args.until):
+        print("--since and --until can only be used with --index-db to --search it")
+        sys.exit(1)
+
+    # Only the logs written within --since/--until are uploaded
+    args.window = parse_window(args.since, args.until)
+    if args.window and None not in args.window and args.window[0] > args.window[1]:
+        print("The --since time must be earlier than the --until time.")
         sys.exit(1)
 
-    # Run filebeat for each triage output specified in the list
-    for path in abs_path_list:
-        # Translates to absolute path and check if directory exists
-        abs_path = os.path.abspath(path)
-        if not os.path.isdir(abs_path):
-            print("The following indicated path cannot be found: " + abs_path)
+    if args.follow and (offline or args.batch or args.window or any(is_archive(abs_path) for abs_path in abs_path_list)):
+        print("--follow can only be used to upload triage folders, without --batch, --since or --until")
+        sys.exit(1)
+
+    if args.resume and (offline or args.ingest == "filebeat" or args.window or args.reset or args.follow):
+        print("--resume can only be used with native or async ingest, without --since, --until, --reset or --follow")
+        sys.exit(1)
+
+    if args.batch and args.ingest != "filebeat":
+        print("--batch can only be used with Filebeat (--ingest filebeat)")
+        sys.exit(1)
+
+    if args.ingest == "filebeat" and not offline and any(is_archive(abs_path) for abs_path in abs_path_list):
+        # Filebeat only reads files on disk, and archives are never extracted
+        print("Triage archives can only be uploaded with --ingest native or async")
+        sys.exit(1)
+
+    # Exports and local indexes are parsed by the native engine, so Filebeat is only needed to upload
+    if args.ingest == "filebeat" and not offline:
+        filebeat_dir = find_filebeat_dir(args.path)
+
+    # Without -s, the OS of each triage output is detected from its release files, so mixed sets load in one run
+    systems = []
+    for abs_path in abs_path_list:
+        system = args.system[0] if args.system and args.system[0] != "auto" else detect_system(abs_path)
+        if system is None:
+            print(f"Unable to detect the OS of {abs_path}. Please specify it with -s")
             sys.exit(1)
 
-        basename = os.path.basename(abs_path)
-        fb_state_dir = check_registry_folder(filebeat_dir, basename)
-
-        # Check and retrieve config file if specified OS exists
-        config_file = check_system(system)
-        print(f"Loading configuration file for {system}...")
-        pprint.pp(config_file)
-
-        preset_cmd = [
-            filebeat_dir + '/filebeat',
-            '-e',
-            '-c', filebeat_dir + '/filebeat.yml',
-            '-E', 'output.elasticsearch.hosts=[\"' + url + '\"]',
-            '-E', 'output.elasticsearch.index=\'' + index_name + '\'',
-            '-E', 'setup.template.name=\'' + index_name + '\'',
-            '-E', 'setup.template.pattern=\'' + index_name + '\'',
-            '-E', 'setup.ilm.enabled=false',
-            '-E', 'filebeat.registry.path=\'' + fb_state_dir + '\''
-        ]
-
-        command, total_expected_doc_count = build_cmd(abs_path, filebeat_dir, preset_cmd, config_file)
-
-        # Print the built command executed
-        print_cmd = ''
-        for cmd in command:
-            print_cmd = print_cmd + " " + cmd
-        print("Command executed:")
-        print(print_cmd)
-
-        # Connect to Elasticsearch
-        es = connect_es(url)
-        create_index(es, index_name)
-
-        query = os.path.join(url, index_name, "_count").replace('\\', '/')
-        curr_doc_count = requests.get(query).json()['count']
+        systems.append(system)
 
-        # Parse the logs to filebeat
-        print("Uploading logs from \"" + basename + "\" to filebeat...")
-        start_time = perf_counter()
+    # Compile each configuration once, before any triage output is processed
+    for system in sorted(set(systems)):
+        check_system(system, filebeat_dir)
 
-        try:
-            subprocess.Popen(command).wait()
+    # Each triage output gets its own registry and spool folder, even if two of them share a basename
+    triage_list = []
+    for abs_path, name, system in zip(abs_path_list, unique_names(abs_path_list), systems):
+        fb_state_dir = check_registry_folder(filebeat_dir, f"{index_name}-{name}", args.reset) if args.ingest == "filebeat" and not args.batch and not offline else None
+        triage_list.append((abs_path, name, system, fb_state_dir))
 
-        except Exception as e:
-            print(e)
+    if args.profile:
+        tracemalloc.start()
 
-        sleep(5)  # Allow some time for the logs to upload completely to filebeat
-        stop_time = perf_counter() - start_time
+    # One pooled client is shared by every triage output, sized for the bulk requests they can have in flight
+    jobs = max(1, min(args.jobs, len(triage_list)))
+    pool_size = args.pool_size or max(DEFAULT_POOL_SIZE, jobs * args.max_inflight)
+    es = None
+    if not offline:
+        es = connect_es(args.url, pool_size, args.sniff)
+        create_index(es, index_name, INDEX_MAPPINGS if args.bulk_load else None)
 
-        """
-        It is recommended to check and refresh the total document count on Elasticsearch itself directly rather than the
-        queried values at runtime of this script (the code below) as the logs may need some time to be uploaded
-        and may not be an accurate representation of the final document count
-        """
-        post_doc_count = requests.get(query).json()['count']
-        uploaded_doc_count = post_doc_count - curr_doc_count
-        failed_doc_count = total_expected_doc_count - uploaded_doc_count
-
-        print("Upload completed!")
-        print(f"Total logs expected: {total_expected_doc_count}")
-        print(f"Total logs uploaded: {uploaded_doc_count}")
-        print(f"Total logs failed to upload: {failed_doc_count}")
-        print(f"Total logs ingested in {index_name} on Elasticsearch: {post_doc_count}")
-        print(f"Time elapsed: {format_time(stop_time)}")
+    with bulk_load(es, index_name, args.force_merge) if args.bulk_load else contextlib.nullcontext():
+        summaries, stop_time = upload_all(args, es, triage_list, filebeat_dir, jobs)
+
+    if stop_time is not None:
+        print_summary(summaries, es.count(index=index_name)['count'] if es else None, index_name, stop_time)
+    write_reports(args, summaries)
+
+    if args.follow:
+        follow_triages(args, es, triage_list)
 
 
 if __name__ == '__main__':
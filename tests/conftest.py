@@ -0,0 +1,123 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import linux_main
+
+
+class StandInElasticsearch:
+    """
+    Stand-in for an Elasticsearch node that keeps the documents of each index by _id, so tests can check what was
+    indexed and how many documents were sent. Documents for which fail(doc) is true are turned down like a mapping
+    error.
+    """
+
+    def __init__(self):
+        self.indices = {}
+        self.sent = 0
+        self.fail = None
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def docs(self, index="idx"):
+        return self.indices.get(index, {})
+
+    def messages(self, index="idx"):
+        return sorted(doc["message"] for doc in self.docs(index).values())
+
+    def bulk(self, index, body):
+        items = []
+        lines = body.decode().splitlines()
+        for action, source in zip(lines[::2], lines[1::2]):
+            action = json.loads(action)["index"]
+            doc = json.loads(source)
+            with self.lock:
+                self.sent += 1
+                if self.fail and self.fail(doc):
+                    items.append({"index": {"status": 400, "error": {"type": "mapper_parsing_exception", "reason": "failed to parse"}}})
+                    continue
+
+                docs = self.indices.setdefault(action.get("_index", index), {})
+                docs[action.get("_id") or f"auto-{len(docs)}"] = doc
+            items.append({"index": {"status": 201}})
+
+        return {"errors": any(item["index"]["status"] >= 300 for item in items), "items": items}
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, code, obj):
+                data = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(data)
+
+            def route(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                parts = self.path.split("?")[0].strip("/").split("/")
+                if not parts[0]:
+                    return self.reply(200, {"version": {"number": "7.17.0", "build_flavor": "default"}, "tagline": "You Know, for Search"})
+
+                index = parts[0]
+                if parts[-1] == "_bulk":
+                    return self.reply(200, stand_in.bulk(index, body))
+
+                if parts[-1] == "_count":
+                    return self.reply(200, {"count": len(stand_in.docs(index))})
+
+                if len(parts) == 1 and self.command == "HEAD":
+                    return self.reply(200 if index in stand_in.indices else 404, {})
+
+                if len(parts) == 1 and self.command == "PUT":
+                    stand_in.indices.setdefault(index, {})
+                    return self.reply(200, {"acknowledged": True, "index": index})
+
+                return self.reply(200, {"acknowledged": True})
+
+            do_HEAD = do_GET = do_POST = do_PUT = route
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def es():
+    with StandInElasticsearch() as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # Runs the script from the repository (for config/) with its upload state and caches kept under tmp_path
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(linux_main, "MANIFEST_DIR", str(tmp_path / "manifests"))
+    monkeypatch.setattr(linux_main, "LINE_COUNT_CACHE", str(tmp_path / "cache" / "line_counts.json"))
+    monkeypatch.setattr(linux_main, "PROFILE_CACHE_DIR", str(tmp_path / "cache" / "profiles"))
+    monkeypatch.setattr(linux_main, "KNOWN_INDICES", set())
+    return tmp_path
@@ -0,0 +1,67 @@
+import linux_main
+
+SYSCALL = (b'type=SYSCALL msg=audit(1633531463.123:4242): arch=c000003e syscall=59 success=yes exit=0 ppid=1200 '
+           b'pid=1234 auid=1000 uid=0 comm="ls" exe="/usr/bin/ls" node=web01 key=(null)')
+EXECVE = b'type=EXECVE msg=audit(1633531463.123:4242): argc=2 a0="ls" a1=2D6C61'
+PROCTITLE = b'type=PROCTITLE msg=audit(1633531463.123:4242): proctitle=6C73002D6C61'
+USER_LOGIN = (b"type=USER_LOGIN msg=audit(1633531470.000:4243): pid=99 uid=0 auid=1000 "
+              b"msg='op=login acct=\"root\" exe=\"/usr/sbin/sshd\" hostname=? addr=10.0.0.5 terminal=ssh res=success'")
+
+
+def test_audit_value_unquotes_strings():
+    assert linux_main.audit_value("SYSCALL", "comm", '"ls"') == "ls"
+    assert linux_main.audit_value("USER_LOGIN", "msg", "'op=login'") == "op=login"
+
+
+def test_audit_value_decodes_hex_fields():
+    assert linux_main.audit_value("PROCTITLE", "proctitle", "6C73002D6C61") == "ls -la"
+    assert linux_main.audit_value("EXECVE", "a1", "2D6C61") == "-la"
+    assert linux_main.audit_value("EXECVE", "a0[1]", "2D6C61") == "-la"
+
+
+def test_audit_value_keeps_other_values():
+    assert linux_main.audit_value("SYSCALL", "a1", "7ffd1234") == "7ffd1234"
+    assert linux_main.audit_value("SYSCALL", "exit", "0") == "0"
+    assert linux_main.audit_value("EXECVE", "argc", "2") == "2"
+
+
+def test_parse_audit_record_splits_fields():
+    fields = linux_main.parse_audit_record(SYSCALL.decode())
+    assert fields["type"] == "SYSCALL"
+    assert fields["comm"] == "ls"
+    assert fields["exe"] == "/usr/bin/ls"
+    assert fields["key"] == "(null)"
+    assert "msg" not in fields
+
+
+def test_parse_audit_record_lifts_nested_msg_fields():
+    fields = linux_main.parse_audit_record(USER_LOGIN.decode())
+    assert fields["op"] == "login"
+    assert fields["acct"] == "root"
+    assert fields["exe"] == "/usr/sbin/sshd"
+    assert fields["res"] == "success"
+    assert fields["pid"] == "99"
+
+
+def test_parse_audit_joins_the_records_of_an_event():
+    doc = linux_main.parse_audit(b"\n".join([SYSCALL, EXECVE, PROCTITLE]))
+
+    assert doc["@timestamp"] == "2021-10-06T14:44:23.123+00:00"
+    assert doc["auditd"]["log"]["sequence"] == 4242
+    assert doc["auditd"]["log"]["record_type"] == "SYSCALL"
+    assert [record["type"] for record in doc["auditd"]["log"]["records"]] == ["SYSCALL", "EXECVE", "PROCTITLE"]
+    assert doc["auditd"]["log"]["records"][1]["a1"] == "-la"
+    assert doc["auditd"]["log"]["records"][2]["proctitle"] == "ls -la"
+    assert doc["host"] == {"hostname": "web01"}
+    assert doc["process"] == {"pid": 1234, "name": "ls", "executable": "/usr/bin/ls"}
+
+
+def test_parse_audit_keeps_lines_that_are_not_audit_records():
+    assert linux_main.parse_audit(b"garbage") == {"message": "garbage"}
+
+
+def test_group_audit_records_joins_consecutive_records_of_an_event():
+    lines = [(0, 10, SYSCALL), (10, 20, EXECVE), (20, 30, PROCTITLE), (30, 40, USER_LOGIN)]
+    groups = list(linux_main.group_audit_records(lines))
+
+    assert groups == [(0, 30, b"\n".join([SYSCALL, EXECVE, PROCTITLE])), (30, 40, USER_LOGIN)]
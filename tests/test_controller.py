@@ -0,0 +1,70 @@
+import pytest
+
+import linux_main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Stands in for perf_counter, so the round trips the controller waits between decreases can be stepped through
+    now = [100.0]
+    monkeypatch.setattr(linux_main, "perf_counter", lambda: now[0])
+    return now
+
+
+def test_fast_requests_grow_the_batches(clock):
+    controller = linux_main.IngestController(1000, 4, adaptive=True)
+    controller.observe(1000, 0.5, 0)
+    controller.observe(1000, 0.5, 0)
+
+    assert controller.batch_size == 1210
+    assert controller.inflight == 4
+
+
+def test_rejections_halve_the_batches_and_requests_once_per_round_trip(clock):
+    controller = linux_main.IngestController(1000, 8, adaptive=True)
+    controller.observe(1000, 0.5, 10)
+    controller.observe(1000, 0.5, 10)
+    assert (controller.batch_size, controller.inflight) == (500, 4)
+
+    clock[0] += 1
+    controller.observe(1000, 0.5, 10)
+    assert (controller.batch_size, controller.inflight) == (250, 2)
+
+    # Requests in flight are let back in one at a time once as many in a row were free of rejections
+    controller.observe(250, 0.5, 0)
+    controller.observe(250, 0.5, 0)
+    assert (controller.batch_size, controller.inflight) == (350, 3)
+
+
+def test_slow_requests_shrink_the_batches(clock):
+    controller = linux_main.IngestController(1000, 4, adaptive=True)
+    controller.observe(1000, 3.0, 0)
+    assert (controller.batch_size, controller.inflight) == (750, 4)
+
+    clock[0] += 1
+    controller.observe(1000, 3.0, 0)
+    assert controller.batch_size == 750
+
+    clock[0] += 5
+    controller.observe(1000, 3.0, 0)
+    assert controller.batch_size == 562
+
+
+def test_backing_off_stops_at_the_smallest_batch_and_one_request(clock):
+    controller = linux_main.IngestController(1000, 8, adaptive=True)
+    for i in range(20):
+        clock[0] += 10
+        controller.observe(100, 0.5, 100)
+
+    assert (controller.batch_size, controller.inflight) == (linux_main.ADAPTIVE_MIN_BATCH_SIZE, 1)
+    assert controller.as_dict()["min_inflight"] == 1
+
+
+def test_fixed_settings_only_record_the_requests(clock):
+    controller = linux_main.IngestController(1000, 4)
+    controller.observe(1000, 3.0, 10)
+    controller.observe(1000, 1.0, 0, retry=True)
+
+    assert (controller.batch_size, controller.inflight) == (1000, 4)
+    stats = controller.as_dict()
+    assert (stats["requests"], stats["retries"], stats["rejected"], stats["mean_latency"]) == (2, 1, 10, 2.0)
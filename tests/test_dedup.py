@@ -0,0 +1,26 @@
+import linux_main
+
+
+def test_seen_lines_remembers_lines():
+    seen = linux_main.SeenLines()
+    assert not seen.is_duplicate(b"Started Session 1 of user root.")
+    assert seen.is_duplicate(b"Started Session 1 of user root.")
+    assert seen.is_duplicate(b"  Started Session 1 of user root.\r")
+    assert not seen.is_duplicate(b"Started Session 2 of user root.")
+    assert seen.duplicates == 2
+
+
+def test_seen_lines_grows_a_second_filter_when_the_first_fills_up():
+    seen = linux_main.SeenLines(capacity=100)
+    lines = [f"line {i}".encode() for i in range(150)]
+
+    assert not any(seen.is_duplicate(line) for line in lines)
+    assert len(seen.filters) == 2
+    assert seen.filters[1][1] > seen.filters[0][1]
+    assert all(seen.is_duplicate(line) for line in lines)
+    assert seen.duplicates == 150
+
+
+def test_seen_lines_probes_at_most_the_maximum_number_of_bits():
+    seen = linux_main.SeenLines(capacity=100)
+    assert all(hashes <= linux_main.DEDUP_MAX_HASHES for bits, size, hashes in seen.filters)
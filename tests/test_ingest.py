@@ -0,0 +1,254 @@
+import datetime
+import gzip
+import os
+import shutil
+import sys
+import tarfile
+import zipfile
+
+import pytest
+
+import linux_main
+
+TRIAGE = "ubuntu-triage_20211006_143423"
+
+
+def syslog_line(i, message="Started Session {i} of user root."):
+    return f"Oct  3 14:{i // 60:02d}:{i % 60:02d} web01 systemd[1]: {message.format(i=i)}\n"
+
+
+def write_syslog(workspace, lines, mode="w"):
+    path = workspace / TRIAGE / "var" / "log" / "syslog"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, mode) as f:
+        f.writelines(lines)
+    return path
+
+
+def pack(workspace, archive):
+    # Packs the triage output in a folder of its own inside a tar.gz or zip archive, and removes the folder
+    path = workspace / f"{TRIAGE}.{archive}"
+    if archive == "zip":
+        with zipfile.ZipFile(path, "w") as f:
+            for root, dirs, files in os.walk(workspace / TRIAGE):
+                for name in files:
+                    f.write(os.path.join(root, name), os.path.relpath(os.path.join(root, name), workspace))
+
+    else:
+        with tarfile.open(path, "w:gz") as f:
+            f.add(workspace / TRIAGE, TRIAGE)
+    shutil.rmtree(workspace / TRIAGE)
+    return path
+
+
+def run(monkeypatch, workspace, es, *args, ingest="native", triage=TRIAGE):
+    argv = ["linux_main.py", "-s", "ubuntu", "-u", es.url, "-i", "idx", "--ingest", ingest, "-w", "1", *args, str(workspace / triage)]
+    monkeypatch.setattr(sys, "argv", argv)
+    monkeypatch.setattr(linux_main, "KNOWN_INDICES", set())
+    linux_main.main()
+
+
+@pytest.mark.parametrize("ingest", ["native", "async"])
+def test_first_run_uploads_every_line(monkeypatch, workspace, es, ingest):
+    write_syslog(workspace, [syslog_line(i) for i in range(50)])
+    run(monkeypatch, workspace, es, ingest=ingest)
+
+    assert es.sent == 50
+    assert es.messages() == sorted(f"Started Session {i} of user root." for i in range(50))
+    doc = next(iter(es.docs().values()))
+    assert doc["tags"] == [TRIAGE]
+    assert doc["event"]["dataset"] == "system.syslog"
+
+
+@pytest.mark.parametrize("ingest", ["native", "async"])
+def test_syslog_documents_carry_their_timestamp(monkeypatch, workspace, es, ingest):
+    path = write_syslog(workspace, [syslog_line(i) for i in range(3)])
+    mtime = datetime.datetime(2021, 10, 6, 14, 34, tzinfo=datetime.timezone.utc).timestamp()
+    os.utime(path, (mtime, mtime))
+    run(monkeypatch, workspace, es, ingest=ingest)
+
+    timestamps = sorted(doc["@timestamp"] for doc in es.docs().values())
+    assert timestamps == [f"2021-10-03T14:00:0{i}.000+00:00" for i in range(3)]
+
+
+@pytest.mark.parametrize("ingest", ["native", "async"])
+def test_rerun_sends_nothing_new(monkeypatch, workspace, es, ingest):
+    write_syslog(workspace, [syslog_line(i) for i in range(50)])
+    run(monkeypatch, workspace, es, ingest=ingest)
+    run(monkeypatch, workspace, es, ingest=ingest)
+
+    assert es.sent == 50
+    assert len(es.docs()) == 50
+
+
+@pytest.mark.parametrize("ingest", ["native", "async"])
+def test_rerun_sends_only_appended_lines(monkeypatch, workspace, es, ingest):
+    write_syslog(workspace, [syslog_line(i) for i in range(50)])
+    run(monkeypatch, workspace, es, ingest=ingest)
+    write_syslog(workspace, [syslog_line(i) for i in range(50, 55)], mode="a")
+    run(monkeypatch, workspace, es, ingest=ingest)
+
+    assert es.sent == 55
+    assert len(es.docs()) == 55
+
+
+@pytest.mark.parametrize("ingest", ["native", "async"])
+def test_resume_sends_only_failed_documents(monkeypatch, workspace, es, ingest):
+    write_syslog(workspace, [syslog_line(i, "Broken {i}" if i % 10 == 3 else "Started Session {i} of user root.") for i in range(50)])
+    es.fail = lambda doc: doc["message"].startswith("Broken")
+    run(monkeypatch, workspace, es, ingest=ingest)
+    assert len(es.docs()) == 45
+
+    es.fail = None
+    es.sent = 0
+    run(monkeypatch, workspace, es, "--resume", ingest=ingest)
+
+    assert es.sent == 5
+    assert len(es.docs()) == 50
+    assert sum(message.startswith("Broken") for message in es.messages()) == 5
+
+
+@pytest.mark.parametrize("ingest", ["native", "async"])
+def test_dedup_drops_a_line_repeated_across_logs(monkeypatch, workspace, es, ingest):
+    path = write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(5)])
+    os.rename(path, str(path) + ".1")
+    write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(3, 5)] + [syslog_line(i, "new{i}") for i in range(3)])
+    run(monkeypatch, workspace, es, "--dedup", ingest=ingest)
+
+    assert es.sent == 8
+    assert es.messages() == sorted([f"old{i}" for i in range(5)] + [f"new{i}" for i in range(3)])
+
+
+def test_dedup_counts_lines_uploaded_by_earlier_runs_as_seen(monkeypatch, workspace, es):
+    write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(5)])
+    run(monkeypatch, workspace, es, "--dedup")
+    write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(2)] + [syslog_line(0, "new0")], mode="a")
+    run(monkeypatch, workspace, es, "--dedup")
+    run(monkeypatch, workspace, es, "--dedup")
+
+    assert es.sent == 6
+    assert es.messages() == sorted([f"old{i}" for i in range(5)] + ["new0"])
+
+
+def test_documents_sent_again_are_not_duplicated(monkeypatch, workspace, es):
+    write_syslog(workspace, [syslog_line(i) for i in range(20)])
+    run(monkeypatch, workspace, es)
+    run(monkeypatch, workspace, es, "--reset")
+
+    assert es.sent == 40
+    assert len(es.docs()) == 20
+
+
+def test_index_db_adds_only_new_lines(monkeypatch, workspace):
+    write_syslog(workspace, [syslog_line(i) for i in range(30)])
+    db = str(workspace / "logs.db")
+    for i in range(2):
+        monkeypatch.setattr(sys, "argv", ["linux_main.py", "-s", "ubuntu", "--index-db", db, "-w", "1", str(workspace / TRIAGE)])
+        linux_main.main()
+
+    store = linux_main.SearchIndex(db)
+    try:
+        assert len(store.search("")) == 30
+        assert len(store.search("Session")) == 30
+
+    finally:
+        store.close()
+
+
+def test_replaced_log_does_not_overwrite_earlier_documents(monkeypatch, workspace, es):
+    path = write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(5)])
+    run(monkeypatch, workspace, es)
+    os.rename(path, str(path) + ".1")
+    write_syslog(workspace, [syslog_line(i, "new{i}") for i in range(3)])
+    run(monkeypatch, workspace, es)
+
+    indexed = {(doc["log"]["file"]["path"], doc["message"]) for doc in es.docs().values()}
+    assert {(str(path), f"old{i}") for i in range(5)} <= indexed
+    assert {(str(path), f"new{i}") for i in range(3)} <= indexed
+
+
+@pytest.mark.parametrize("ingest", ["native", "async"])
+def test_rerun_does_not_upload_renamed_rotation_again(monkeypatch, workspace, es, ingest):
+    path = write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(5)])
+    run(monkeypatch, workspace, es, ingest=ingest)
+    os.rename(path, str(path) + ".1")
+    write_syslog(workspace, [syslog_line(i, "new{i}") for i in range(3)])
+    run(monkeypatch, workspace, es, ingest=ingest)
+
+    assert es.sent == 8
+    assert es.messages() == sorted([f"old{i}" for i in range(5)] + [f"new{i}" for i in range(3)])
+
+
+def test_copy_beside_an_unchanged_log_is_uploaded(monkeypatch, workspace, es):
+    path = write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(5)])
+    run(monkeypatch, workspace, es)
+    shutil.copy(path, str(path) + ".1")
+    run(monkeypatch, workspace, es)
+
+    indexed = {(doc["log"]["file"]["path"], doc["message"]) for doc in es.docs().values()}
+    assert es.sent == 10
+    assert {(str(path) + ".1", f"old{i}") for i in range(5)} <= indexed
+
+
+def test_rerun_uploads_only_the_unsent_tail_of_a_compressed_rotation(monkeypatch, workspace, es):
+    path = write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(5)])
+    run(monkeypatch, workspace, es)
+    write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(5, 7)], mode="a")
+    with open(path, "rb") as f_in, gzip.open(str(path) + ".2.gz", "wb") as f_out:
+        f_out.write(f_in.read())
+    os.remove(path)
+    run(monkeypatch, workspace, es)
+
+    assert es.sent == 7
+    assert es.messages() == sorted(f"old{i}" for i in range(7))
+
+
+def test_index_db_does_not_index_renamed_rotation_again(monkeypatch, workspace):
+    path = write_syslog(workspace, [syslog_line(i, "old{i}") for i in range(5)])
+    db = str(workspace / "logs.db")
+    monkeypatch.setattr(sys, "argv", ["linux_main.py", "-s", "ubuntu", "--index-db", db, "-w", "1", str(workspace / TRIAGE)])
+    linux_main.main()
+    os.rename(path, str(path) + ".1")
+    write_syslog(workspace, [syslog_line(i, "new{i}") for i in range(3)])
+    linux_main.main()
+
+    store = linux_main.SearchIndex(db)
+    try:
+        assert sorted(message for timestamp, host, path, message in store.search("")) == sorted([f"old{i}" for i in range(5)] + [f"new{i}" for i in range(3)])
+
+    finally:
+        store.close()
+
+
+def test_spooled_rotations_keep_their_source_path(workspace):
+    filebeat_dir = workspace / "filebeat"
+    (filebeat_dir / "modules.d").mkdir(parents=True)
+    for module in ("system", "auditd"):
+        (filebeat_dir / "modules.d" / f"{module}.yml.disabled").touch()
+    path = write_syslog(workspace, [syslog_line(0)])
+    with gzip.open(str(path) + ".2.gz", "wt") as f:
+        f.write(syslog_line(1))
+
+    profile = linux_main.check_system("ubuntu", str(filebeat_dir))
+    spool_dir = os.path.abspath(os.path.join(str(filebeat_dir), "data", "spool", TRIAGE, "run"))
+    inputs, expected, shipped = linux_main.collect_filebeat_logs(str(workspace / TRIAGE), str(filebeat_dir), profile, spool_dir, 1)
+
+    sources = {ship_file: file for module, filetype, ship_files, sources in inputs for ship_file, file in sources.items()}
+    assert list(sources.values()) == [str(path) + ".2.gz"]
+    assert all(os.path.isabs(ship_file) and ship_file.startswith(spool_dir) for ship_file in sources)
+    assert linux_main.source_fields(sources)[0]["add_fields"]["fields"] == {"source_path": str(path) + ".2.gz"}
+
+
+@pytest.mark.parametrize("archive", ["tar.gz", "zip"])
+@pytest.mark.parametrize("ingest", ["native", "async"])
+def test_archive_is_uploaded_once(monkeypatch, workspace, es, ingest, archive):
+    path = write_syslog(workspace, [syslog_line(i, "new{i}") for i in range(3)])
+    with gzip.open(str(path) + ".2.gz", "wt") as f:
+        f.writelines(syslog_line(i, "old{i}") for i in range(5))
+    pack(workspace, archive)
+    run(monkeypatch, workspace, es, ingest=ingest, triage=f"{TRIAGE}.{archive}")
+    run(monkeypatch, workspace, es, ingest=ingest, triage=f"{TRIAGE}.{archive}")
+
+    assert es.sent == 8
+    assert es.messages() == sorted([f"old{i}" for i in range(5)] + [f"new{i}" for i in range(3)])
+    assert all(doc["tags"] == [TRIAGE] for doc in es.docs().values())
@@ -0,0 +1,66 @@
+import calendar
+import os
+
+import linux_main
+
+# 6 Oct 2021, the collection time of the triage outputs used in the tests
+MTIME = calendar.timegm((2021, 10, 6, 14, 34, 23))
+
+
+def at(*moment):
+    return calendar.timegm(moment + (0,) * (6 - len(moment)))
+
+
+def write_log(tmp_path, lines, name="syslog"):
+    path = tmp_path / name
+    path.write_bytes(b"".join(line + b"\n" for line in lines))
+    os.utime(path, (MTIME, MTIME))
+    return str(path)
+
+
+def test_line_timestamp_reads_syslog_rfc3339_and_audit_lines():
+    reference = (2021, 10)
+    assert linux_main.line_timestamp(b"Oct  3 14:00:01 web01 systemd[1]: Started.", reference) == at(2021, 10, 3, 14, 0, 1)
+    assert linux_main.line_timestamp(b"2021-10-03T14:00:01+02:00 web01 sshd[7]: Accepted", reference) == at(2021, 10, 3, 12, 0, 1)
+    assert linux_main.line_timestamp(b"2021-10-03T14:00:01Z web01 sshd[7]: Accepted", reference) == at(2021, 10, 3, 14, 0, 1)
+    assert linux_main.line_timestamp(b"type=SYSCALL msg=audit(1633269601.500:42): syscall=59", reference) == 1633269601.5
+    assert linux_main.line_timestamp(b"    at java.lang.Thread.run(Thread.java:748)", reference) is None
+
+
+def test_line_timestamp_takes_the_year_from_the_mtime(tmp_path):
+    reference = linux_main.time_reference(write_log(tmp_path, []))
+    assert reference == (2021, 10)
+    assert linux_main.line_timestamp(b"Oct  3 14:00:01 web01 cron[1]: x", reference) == at(2021, 10, 3, 14, 0, 1)
+    # A month after the log was last written is from the year before
+    assert linux_main.line_timestamp(b"Dec 31 23:59:59 web01 cron[1]: x", reference) == at(2020, 12, 31, 23, 59, 59)
+
+
+def test_classify_file(tmp_path):
+    path = write_log(tmp_path, [b"Oct  3 10:00:00 web01 cron[1]: first", b"Oct  3 12:00:00 web01 cron[1]: last"])
+
+    assert linux_main.classify_file(path, (at(2021, 10, 4), None)) == "skip"
+    assert linux_main.classify_file(path, (None, at(2021, 10, 2))) == "skip"
+    assert linux_main.classify_file(path, (at(2021, 10, 3), at(2021, 10, 4))) == "all"
+    assert linux_main.classify_file(path, (at(2021, 10, 3, 11), None)) == "filter"
+
+
+def test_classify_file_filters_logs_without_timestamps(tmp_path):
+    path = write_log(tmp_path, [b"no timestamp here"])
+    assert linux_main.classify_file(path, (at(2021, 10, 4), None)) == "filter"
+
+
+def test_window_filter(tmp_path):
+    path = write_log(tmp_path, [b"Oct  3 10:00:00 web01 cron[1]: first", b"Oct  3 12:00:00 web01 cron[1]: last"])
+
+    assert linux_main.window_filter(path, None) is None
+    assert linux_main.window_filter(path, (at(2021, 10, 4), None)) == "skip"
+    assert linux_main.window_filter(path, (at(2021, 10, 3), None)) is None
+    assert isinstance(linux_main.window_filter(path, (at(2021, 10, 3, 11), None)), linux_main.WindowFilter)
+
+
+def test_untimestamped_lines_follow_the_line_before_them(tmp_path):
+    lines = [b"Oct  3 10:00:00 web01 java[1]: Exception", b"    at Main.run(Main.java:1)",
+             b"Oct  3 12:00:00 web01 java[1]: Exception", b"    at Main.run(Main.java:2)"]
+    line_filter = linux_main.window_filter(write_log(tmp_path, lines), (at(2021, 10, 3, 11), None))
+
+    assert [line_filter.accept(line) for line in lines] == [False, False, True, True]